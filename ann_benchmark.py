@@ -0,0 +1,86 @@
+import sys
+import time
+
+import numpy as np
+
+from ann_index import recall_at_k
+from vector_index import EMBEDDING_DIM, VectorIndex, normalize_rows
+
+# ==========================================
+# CONFIG
+# ==========================================
+NUM_ROWS = 200_000  # synthetic corpus size (ignored when an index dir is given)
+NUM_CLUSTERS = 2_000  # topics in the synthetic corpus
+NUM_QUERIES = 200
+TOP_K = 10
+NPROBES = (1, 2, 4, 8, 16, 32)
+STORAGE = "float16"  # synthetic corpus storage; float32 needs ~1.2GB at 200k
+BLOCK_ROWS = 50_000  # synthetic rows generated and added at a time
+
+
+# ==========================================
+# DATA
+# ==========================================
+def synthetic_index(num_rows=NUM_ROWS, dim=EMBEDDING_DIM, seed=0):
+    """Clustered unit vectors standing in for chunk embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((NUM_CLUSTERS, dim)))
+    index = VectorIndex(dim=dim, storage=STORAGE)
+    for start in range(0, num_rows, BLOCK_ROWS):
+        n = min(BLOCK_ROWS, num_rows - start)
+        noise = rng.standard_normal((n, dim)).astype(np.float32) * 0.03
+        block = centers[rng.integers(0, NUM_CLUSTERS, n)] + noise
+        chunks = [{"text": f"synthetic {start + i}", "source": "synthetic"} for i in range(n)]
+        index.add(chunks, block)
+    return index
+
+
+def sample_queries(index, num_queries=NUM_QUERIES, seed=1):
+    """Perturbed copies of random rows, so every query has real neighbours."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(index), num_queries, replace=False)
+    base = np.asarray(index.matrix[np.sort(rows)], dtype=np.float32)
+    return normalize_rows(base + rng.standard_normal(base.shape).astype(np.float32) * 0.03)
+
+
+# ==========================================
+# BENCHMARK
+# ==========================================
+def time_search(index, queries, **options):
+    """Run every query; return (top rows per query, median latency in ms)."""
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = index._dense_top(query, TOP_K, **options)
+        latencies.append(time.perf_counter() - start)
+        results.append(rows)
+    return results, 1000 * float(np.median(latencies))
+
+
+def run_benchmark(index, rebuild_ann=False):
+    queries = sample_queries(index)
+    print(f"Index: {len(index):,} rows x {index.dim} dims, {len(queries)} queries")
+
+    exact, exact_ms = time_search(index, queries, exact=True)
+    print(f"exact        recall@{TOP_K}=1.000  p50={exact_ms:.3f}ms")
+
+    # The index builds IVF itself as it grows; retrain over the full corpus
+    # so the timing and recall reflect one build over every row
+    if index.ann is None or rebuild_ann:
+        start = time.perf_counter()
+        index.build_ann()
+        print(f"IVF built in {time.perf_counter() - start:.1f}s (nlist={index.ann.nlist})")
+
+    for nprobe in NPROBES:
+        approx, approx_ms = time_search(index, queries, nprobe=nprobe)
+        recall = np.mean([recall_at_k(a, e) for a, e in zip(approx, exact)])
+        print(f"nprobe={nprobe:<5}  recall@{TOP_K}={recall:.3f}  p50={approx_ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    # python ann_benchmark.py [saved_index_dir]
+    if len(sys.argv) > 1:
+        run_benchmark(VectorIndex.load(sys.argv[1]))
+    else:
+        run_benchmark(synthetic_index(), rebuild_ann=True)
@@ -0,0 +1,120 @@
+import numpy as np
+
+# IVF (inverted file) settings. Rows are bucketed by their nearest k-means
+# centroid; a query only scores the rows in its nprobe closest buckets.
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+TRAIN_SAMPLES_PER_LIST = 64  # k-means is trained on nlist * this many rows
+ASSIGN_BLOCK_ROWS = 16384
+
+
+def default_nlist(num_rows):
+    """Roughly 4 * sqrt(n) buckets, the usual IVF rule of thumb."""
+    return max(1, int(4 * np.sqrt(num_rows)))
+
+
+def _as_float32(block):
+    return np.asarray(block, dtype=np.float32)
+
+
+def _nearest_centroids(matrix, centroids):
+    """Index of the highest-cosine centroid for every row, block by block."""
+    assignments = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), ASSIGN_BLOCK_ROWS):
+        block = _as_float32(matrix[start : start + ASSIGN_BLOCK_ROWS])
+        assignments[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(matrix, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on a sample of unit-length rows."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(matrix), nlist * TRAIN_SAMPLES_PER_LIST)
+    sample = _as_float32(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        filled = norms[:, 0] > 0
+        centroids[filled] = sums[filled] / norms[filled]
+    return centroids
+
+
+class IVFIndex:
+    """Approximate nearest-neighbour search over a VectorIndex matrix.
+
+    Only row numbers are stored; vectors stay in the owning index's matrix,
+    so the IVF layer costs one int per row plus the centroids. nprobe trades
+    recall for latency: more buckets scored means closer to exact search.
+    """
+
+    def __init__(self, centroids, nprobe=DEFAULT_NPROBE):
+        self.centroids = _as_float32(centroids)
+        self.nprobe = nprobe
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._arrays = {}  # list id -> cached np array of its rows
+        self.size = 0
+        self.trained_rows = 0  # rows the centroids were trained on
+
+    @classmethod
+    def build(cls, matrix, nlist=None, nprobe=DEFAULT_NPROBE):
+        """Train centroids on matrix and bucket all of its rows."""
+        nlist = min(nlist or default_nlist(len(matrix)), len(matrix))
+        ivf = cls(train_centroids(matrix, nlist), nprobe=nprobe)
+        ivf.add(matrix, start_row=0)
+        ivf.trained_rows = len(matrix)
+        return ivf
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def add(self, vectors, start_row):
+        """Bucket vectors that were stored at rows start_row, start_row + 1, ..."""
+        self.assign(_nearest_centroids(vectors, self.centroids), start_row)
+
+    def assign(self, assignments, start_row=0):
+        """Append rows start_row, start_row + 1, ... to the given buckets."""
+        assignments = np.asarray(assignments)
+        order = np.argsort(assignments, kind="stable")
+        list_ids, starts = np.unique(assignments[order], return_index=True)
+        rows = (start_row + order).tolist()
+        bounds = list(starts[1:]) + [len(order)]
+        for list_id, lo, hi in zip(list_ids.tolist(), starts.tolist(), bounds):
+            self._lists[list_id].extend(rows[lo:hi])
+            self._arrays.pop(list_id, None)
+        self.size += len(assignments)
+
+    def assignments(self):
+        """Bucket of every row, in row order (for saving)."""
+        out = np.empty(self.size, dtype=np.int32)
+        for list_id, rows in enumerate(self._lists):
+            out[rows] = list_id
+        return out
+
+    def _rows(self, list_id):
+        rows = self._arrays.get(list_id)
+        if rows is None:
+            rows = self._arrays[list_id] = np.asarray(self._lists[list_id], dtype=np.int64)
+        return rows
+
+    def candidates(self, query, nprobe=None):
+        """Rows in the nprobe buckets closest to the (unit) query, sorted."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        rows = np.concatenate([self._rows(list_id) for list_id in probe])
+        # Sorted gathers read a memory-mapped matrix sequentially
+        rows.sort()
+        return rows
+
+
+def recall_at_k(approx_rows, exact_rows):
+    """Fraction of the exact top-k rows that the approximate search found."""
+    if len(exact_rows) == 0:
+        return 1.0
+    return len(set(map(int, approx_rows)) & set(map(int, exact_rows))) / len(exact_rows)
@@ -0,0 +1,113 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_ENTRIES = 1_000
+TTL_SECONDS = 24 * 60 * 60
+SIMILARITY_THRESHOLD = 0.95  # query-embedding cosine for a paraphrase hit
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?!. ")
+
+
+class AnswerCache:
+    """Answers to earlier questions, per index version.
+
+    Exact tier: keyed on (index key, normalized question). Paraphrase tier:
+    entries stored with a query embedding match a new question whose
+    embedding has cosine >= similarity_threshold. Entries expire after
+    ttl_seconds and the least recently used are evicted past max_entries.
+    Keys include the index version, so adding or removing chunks
+    invalidates every answer computed against the old contents.
+    """
+
+    def __init__(
+        self,
+        max_entries=MAX_ENTRIES,
+        ttl_seconds=TTL_SECONDS,
+        similarity_threshold=SIMILARITY_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (index key, question) -> entry
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry["created"] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, question, index):
+        """Exact-tier lookup; returns the cached entry or None."""
+        key = (index.cache_key, normalize_question(question))
+        with self._lock:
+            entry = self._live(key, time.time())
+        return entry
+
+    def get_similar(self, query_embedding, index):
+        """Paraphrase-tier lookup by query-embedding cosine similarity."""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        now = time.time()
+        with self._lock:
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if key[0] == index.cache_key and entry["embedding"] is not None
+            ]
+            if not keys:
+                return None
+            matrix = np.stack([self._entries[key]["embedding"] for key in keys])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            return self._live(keys[best], now)
+
+    def put(self, question, index, result, answer=None, embedding=None):
+        """Store a finished run_query result (answer overrides result["answer"])."""
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        entry = {
+            "rewritten_query": result["rewritten_query"],
+            "chunks": result["chunks"],
+            "retrieval_class": result["retrieval_class"],
+            "answer": answer if answer is not None else result["answer"],
+            "generation_class": result["generation_class"],
+            "embedding": embedding,
+            "created": time.time(),
+        }
+        key = (index.cache_key, normalize_question(question))
+        with self._lock:
+            # Answers for older versions of this index can never hit again
+            for stale in [k for k in self._entries if k[0][0] == key[0][0] and k[0] != key[0]]:
+                del self._entries[stale]
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """Return the process-wide answer cache, creating it on first use."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = AnswerCache()
+        return _default_cache
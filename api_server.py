@@ -0,0 +1,243 @@
+"""Headless HTTP service for the query pipeline.
+
+Run with:  python api_server.py  (then POST to /indexes/<name>/documents and
+/indexes/<name>/query). Indexes live in memory on the process-wide shared
+embedding store, like Streamlit sessions do.
+
+Queries run on the event loop through run_query_async, so one process
+serves many at once. Their embeddings are micro-batched: everything that
+arrives within BATCH_WINDOW_SECONDS goes out as one embeddings request.
+"""
+
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from answer_cache import get_answer_cache
+from chunk_articles import chunk_article
+from clients import breaker, metrics
+from embedding_batcher import BATCH_WINDOW_SECONDS, QueryEmbeddingBatcher
+from embedding_cache import get_embedding_cache
+from embedding_dispatcher import get_dispatcher
+from query_pipeline import run_query_async
+from shared_store import get_shared_store
+from document_loader import scrape_url
+from vector_index import EMBEDDING_DIM, VectorIndex, content_hash
+
+# ==========================================
+# CONFIG
+# ==========================================
+HOST = os.getenv("SUPAI_HOST", "0.0.0.0")
+PORT = int(os.getenv("SUPAI_PORT", "8080"))
+WORKER_THREADS = int(os.getenv("SUPAI_WORKERS", "8"))  # scraping, chunking, ingest embedding
+INDEX_STORAGE = "int8"
+MAX_REQUEST_BYTES = 10 * 1024 * 1024
+DEFAULT_TOP_K = 3
+MAX_TOP_K = 20
+
+
+# ==========================================
+# INDEXES
+# ==========================================
+class IndexSlot:
+    """A named index.
+
+    Queries read it on the event loop, in the synchronous stretches of
+    run_query_async between awaits. Ingests embed in a worker thread and
+    then apply the change on the event loop too, so a write never
+    interleaves with a read and queries never wait on a lock.
+    """
+
+    def __init__(self):
+        self.index = VectorIndex(
+            storage=INDEX_STORAGE, store=get_shared_store(EMBEDDING_DIM, INDEX_STORAGE)
+        )
+        self.ingest_lock = asyncio.Lock()  # one ingest at a time per index
+
+
+def embed_texts(texts):
+    """Embed texts in API-sized batches through the embedding cache.
+
+    Returns:
+        tuple: (embeddings, cost)
+    """
+    if not texts:
+        return [], 0.0
+    embeddings, stats = get_dispatcher().embed(texts, cache=get_embedding_cache())
+    return embeddings, stats["cost"]
+
+
+def embed_queries(texts):
+    """Embed one micro-batch of questions. Returns (embeddings, cost).
+
+    Skips the embedding cache: repeated questions are the answer cache's
+    job, and one-off query strings would evict chunk embeddings from it.
+    """
+    embeddings, stats = get_dispatcher().embed(texts)
+    return embeddings, stats["cost"]
+
+
+async def ingest(request, name, source, text):
+    """Chunk text and (re-)ingest it as source into the named index.
+
+    Only changed chunks are embedded. The index is created once there is
+    something to put in it.
+    """
+    chunks = await _run(request, chunk_article, text, source)
+    if not chunks:
+        raise ValueError("No chunks could be extracted from this text")
+
+    indexes = request.app["indexes"]
+    slot = indexes.get(name)
+    if slot is None:
+        slot = indexes[name] = IndexSlot()
+
+    async with slot.ingest_lock:
+        existing = slot.index.source_rows(source)
+        pending = {}
+        for chunk in chunks:
+            h = chunk.setdefault("hash", content_hash(chunk["text"]))
+            if h not in existing:
+                pending.setdefault(h, chunk["text"])
+        embeddings, cost = await _run(request, embed_texts, list(pending.values()))
+        by_hash = dict(zip(pending, embeddings))
+
+        def embed(to_embed):
+            return [by_hash[chunk["hash"]] for chunk in to_embed], cost
+
+        summary = slot.index.update_source(source, chunks, embed)
+
+    summary["chunks"] = len(slot.index)
+    return summary
+
+
+async def query(request, slot, question, top_k):
+    result = await run_query_async(
+        question,
+        slot.index,
+        top_k=top_k,
+        answer_cache=get_answer_cache(),
+        speculative=True,
+        embed=request.app["batcher"].embed,
+    )
+
+    return {
+        "question": result["question"],
+        "rewritten_query": result["rewritten_query"],
+        "answer": result["answer"],
+        "chunks": [
+            {key: chunk[key] for key in ("text", "source", "similarity", "coverage") if key in chunk}
+            for chunk in result["chunks"]
+        ],
+        "retrieval_class": result["retrieval_class"],
+        "generation_class": result["generation_class"],
+        "retrieval_path": result["retrieval_path"],
+        "cached": result["cached"],
+        "cost": result["cost"],
+        "latency": result["latency"],
+    }
+
+
+# ==========================================
+# HTTP HANDLERS
+# ==========================================
+json_response = functools.partial(
+    web.json_response, dumps=functools.partial(json.dumps, default=float)
+)
+
+
+def _error(status, message):
+    return json_response({"error": message}, status=status)
+
+
+async def _run(request, fn, *args):
+    """Run a blocking call on the worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app["workers"], functools.partial(fn, *args))
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    return body
+
+
+async def health(request):
+    batcher = request.app["batcher"]
+    return json_response(
+        {
+            "status": "ok",
+            "indexes": {name: len(slot.index) for name, slot in request.app["indexes"].items()},
+            "embedding_batches": batcher.batches_sent,
+            "embedded_queries": batcher.texts_sent,
+            "circuit_breaker": breaker.state,
+            "api_calls": metrics.snapshot(),
+        }
+    )
+
+
+async def ingest_document(request):
+    """POST {"url": ...} or {"source": ..., "text": ...}."""
+    body = await _json_body(request)
+    name = request.match_info["name"]
+    if not (body.get("url") or (body.get("text") and body.get("source"))):
+        return _error(400, 'Provide "url", or "source" and "text"')
+
+    try:
+        if body.get("url"):
+            article = await _run(request, scrape_url, body["url"])
+            source, text = article["source"], article["text"]
+        else:
+            source, text = body["source"], body["text"]
+        summary = await ingest(request, name, source, text)
+    except ValueError as e:
+        return _error(422, str(e))
+    return json_response({"index": name, "source": source, **summary})
+
+
+async def query_index(request):
+    """POST {"question": ..., "top_k": 3}."""
+    body = await _json_body(request)
+    name = request.match_info["name"]
+    slot = request.app["indexes"].get(name)
+    if slot is None or len(slot.index) == 0:
+        return _error(404, f"Index {name!r} has no documents")
+
+    question = str(body.get("question", "")).strip()
+    if not question:
+        return _error(400, 'Provide a "question"')
+    try:
+        top_k = min(max(int(body.get("top_k", DEFAULT_TOP_K)), 1), MAX_TOP_K)
+    except (TypeError, ValueError):
+        return _error(400, '"top_k" must be an integer')
+
+    return json_response(await query(request, slot, question, top_k))
+
+
+async def _shutdown_workers(app):
+    app["workers"].shutdown(wait=False, cancel_futures=True)
+    app["batcher"].close()
+
+
+def make_app(window_seconds=BATCH_WINDOW_SECONDS, workers=WORKER_THREADS):
+    app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+    app["indexes"] = {}
+    app["workers"] = ThreadPoolExecutor(max_workers=workers)
+    app["batcher"] = QueryEmbeddingBatcher(embed_queries, window_seconds=window_seconds)
+    app.on_cleanup.append(_shutdown_workers)
+    app.router.add_get("/health", health)
+    app.router.add_post("/indexes/{name}/documents", ingest_document)
+    app.router.add_post("/indexes/{name}/query", query_index)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(make_app(), host=HOST, port=PORT)
@@ -1,13 +1,15 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from upload_utils import (
-    scrape_url,
-    process_file_bytes,
-    create_embeddings_with_progress,
-)
+from document_loader import scrape_url
+from upload_utils import create_embeddings_with_progress
+from clients import token_cost
+from embedding_dispatcher import EMBED_MODEL
 from chunk_articles import chunk_article
-from retrieval import retrieve_relevant_chunks
-from rag_pipeline import generate_answer, handle_refusal
+from ingestion import iter_file_chunks
+from vector_index import EMBEDDING_DIM, VectorIndex, content_hash
+from shared_store import get_shared_store
+from dedup import Deduplicator
+from retrieval import score_label
 
 # ==========================================
 # LIMITS
@@ -16,6 +18,15 @@ SESSION_BUDGET = 0.10  # Max $0.10 per session
 MAX_SOURCES = 5  # Max 5 sources per session
 MAX_FILE_SIZE_MB = 10  # Max 10MB per file
 MAX_CHUNKS = 500  # Max 500 chunks in index
+MAX_INDEX_TOKENS = 250_000  # Max embedded tokens in index (~500 chunks)
+INDEX_STORAGE = "int8"  # ~1.5KB per chunk embedding instead of 6KB float32
+
+
+@st.cache_resource
+def shared_store():
+    """Embedding rows shared by every session (one copy per distinct chunk)."""
+    return get_shared_store(EMBEDDING_DIM, INDEX_STORAGE)
+
 
 # Page config
 st.set_page_config(
@@ -167,7 +178,8 @@ st.markdown(
 # ==========================================
 if "app_state" not in st.session_state:
     st.session_state.app_state = "entry"
-    st.session_state.index_data = []
+    st.session_state.index_data = VectorIndex(store=shared_store())
+    st.session_state.deduplicator = Deduplicator()
     st.session_state.sources = set()
     st.session_state.messages = []
     st.session_state.processing_input = None
@@ -282,7 +294,10 @@ if url_go and url_input:
         sidebar_error = "Please enter a valid URL starting with http:// or https://"
     elif budget_exceeded():
         sidebar_error = "Session budget exceeded. Please start a new session."
-    elif len(st.session_state.sources) >= MAX_SOURCES:
+    elif (
+        url_stripped not in st.session_state.sources
+        and len(st.session_state.sources) >= MAX_SOURCES
+    ):
         sidebar_error = f"Maximum {MAX_SOURCES} sources per session."
     else:
         st.session_state.processing_input = {"type": "url", "value": url_stripped}
@@ -301,7 +316,9 @@ if file_go and uploaded_files:
         )
     elif budget_exceeded():
         sidebar_error = "Session budget exceeded. Please start a new session."
-    elif len(st.session_state.sources) + len(uploaded_files) > MAX_SOURCES:
+    elif (
+        len(st.session_state.sources | {f.name for f in uploaded_files}) > MAX_SOURCES
+    ):
         sidebar_error = f"Maximum {MAX_SOURCES} sources per session. You have {len(st.session_state.sources)} already."
     else:
         file_data = [{"name": f.name, "bytes": f.read()} for f in uploaded_files]
@@ -341,36 +358,140 @@ elif st.session_state.app_state == "processing":
 
     status = st.status("Processing content...", expanded=True)
     with status:
-        articles = []
+        chunk_stream = []
         failed = False
+        file_errors = {}
 
         if pending["type"] == "url":
             st.write("🌐 Fetching article...")
             try:
                 article = scrape_url(pending["value"])
-                articles.append(article)
                 st.write("✓ Extracted text")
+                chunk_stream = chunk_article(article["text"], article["filename"])
             except Exception as e:
                 st.error(str(e))
                 failed = True
 
         elif pending["type"] == "files":
-            st.write("📄 Reading PDFs...")
+            st.write("📄 Reading files...")
             progress = st.progress(0)
-            for i, item in enumerate(pending["value"]):
-                try:
-                    article = process_file_bytes(item["name"], item["bytes"])
-                    articles.append(article)
-                    st.write(f"✓ {item['name']}")
-                except Exception as e:
-                    st.error(f"✗ {item['name']}: {e}")
-                progress.progress((i + 1) / len(pending["value"]))
-
-        if failed or not articles:
+            finished = []
+
+            def on_file_done(name, error):
+                finished.append(name)
+                if error:
+                    file_errors[name] = error
+                    st.error(f"✗ {name}: {error}")
+                else:
+                    st.write(f"✓ {name}")
+                progress.progress(len(finished) / len(pending["value"]))
+
+            # Extraction fans out across CPU cores; chunks stream out in order
+            chunk_stream = iter_file_chunks(pending["value"], on_file_done=on_file_done)
+
+        all_chunks = []
+        duplicates = []
+        duplicate_sources = set()
+        unchanged = []
+        shared = []  # embedded earlier by some session; vectors reused
+        existing = {}  # source -> {content hash: row} already in the index
+        kept_hashes = {}  # source -> hashes still present in the new version
+        trimmed = False
+        if not failed:
+            # Embed chunks as they are produced, up to the chunk and token
+            # limits. Each chunk's token count is known before it is sent, so
+            # we stop before the predicted embedding cost exceeds the budget.
+            chunk_iter = iter(chunk_stream)
+            room = max(0, MAX_CHUNKS - len(st.session_state.index_data))
+            index_token_room = MAX_INDEX_TOKENS - st.session_state.index_data.total_tokens
+            spend_token_room = (
+                SESSION_BUDGET - st.session_state.session_cost
+            ) / token_cost(EMBED_MODEL, 1)
+            over_budget = []
+            index = st.session_state.index_data
+            deduplicator = st.session_state.deduplicator
+
+            def take_chunks():
+                taken = 0
+                index_tokens = 0
+                spend_tokens = 0
+                for chunk in chunk_iter:
+                    # Re-fetched or re-uploaded sources: chunks whose content
+                    # is already indexed keep their rows and aren't re-embedded
+                    source = chunk["source"]
+                    if source not in existing:
+                        existing[source] = index.source_rows(source)
+                        kept_hashes[source] = set()
+                    chunk["hash"] = content_hash(chunk["text"])
+                    kept_hashes[source].add(chunk["hash"])
+                    if chunk["hash"] in existing[source]:
+                        unchanged.append(chunk)
+                        continue
+
+                    # Near-duplicates (nav text, disclaimers, the same article
+                    # from two URLs) are merged into the chunk we already have.
+                    # This source's previous chunks don't count: a near-match
+                    # there is an edit, which replaces the old chunk
+                    kept, signature = deduplicator.find(chunk, exclude_hashes=existing[source])
+                    if kept is not None:
+                        deduplicator.merge(kept, chunk)
+                        kept_hashes[source].add(kept["hash"])
+                        duplicate_sources.add(source)
+                        duplicates.append(chunk)
+                        continue
+                    index_tokens += chunk["tokens"]
+                    if taken >= room or index_tokens > index_token_room:
+                        over_budget.append(chunk)
+                        return
+                    # Chunks another session already embedded are free
+                    is_shared = index.shares(chunk["hash"])
+                    if not is_shared:
+                        spend_tokens += chunk["tokens"]
+                        if spend_tokens > spend_token_room:
+                            over_budget.append(chunk)
+                            return
+                    deduplicator.register(chunk, signature)
+                    taken += 1
+                    if is_shared and not index.add_shared([chunk]):
+                        shared.append(chunk)
+                        continue
+                    all_chunks.append(chunk)
+                    yield chunk
+
+            try:
+                embeddings, embed_cost = create_embeddings_with_progress(take_chunks())
+            except BaseException:
+                # These chunks never reach the index. Left registered, a
+                # retry of the same upload would merge every chunk into its
+                # own unindexed copy and index nothing
+                for chunk in all_chunks:
+                    deduplicator.forget(chunk)
+                raise
+            st.session_state.session_cost += embed_cost
+            st.write(f"→ {len(all_chunks) + len(shared)} chunks")
+            if shared:
+                st.write(f"🤝 Reused {len(shared)} chunks already embedded on this server")
+            if unchanged:
+                st.write(f"♻️ Reused {len(unchanged)} unchanged chunks")
+            if duplicates:
+                st.write(f"🧹 Merged {len(duplicates)} near-duplicate chunks")
+            st.write(f"Embedding cost: ${embed_cost:.4f}")
+
+            trimmed = bool(over_budget) or next(chunk_iter, None) is not None
+            if hasattr(chunk_iter, "close"):
+                chunk_iter.close()
+            if pending["type"] == "files" and len(file_errors) == len(pending["value"]):
+                failed = True
+                for chunk in all_chunks:
+                    deduplicator.forget(chunk)
+
+        if failed:
             status.update(label="Failed", state="error")
+        elif not (all_chunks or shared or duplicates or unchanged):
+            status.update(label="No chunks", state="error")
 
     # Error handling outside status block
-    if failed or not articles:
+    if failed:
         st.session_state.processing_input = None
         st.error("Could not process the content. Please try a different link or file.")
         if st.button("← Go Back"):
@@ -380,18 +501,7 @@ elif st.session_state.app_state == "processing":
             st.rerun()
         st.stop()
 
-    with status:
-        st.write("✂️ Chunking text...")
-        all_chunks = []
-        for article in articles:
-            chunks = chunk_article(article["text"], article["filename"])
-            all_chunks.extend(chunks)
-        st.write(f"→ {len(all_chunks)} chunks")
-
-        if not all_chunks:
-            status.update(label="No chunks", state="error")
-
-    if not all_chunks:
+    if not (all_chunks or shared or duplicates or unchanged):
         st.session_state.processing_input = None
         st.error("Could not extract enough text to create chunks.")
         if st.button("← Go Back"):
@@ -402,28 +512,28 @@ elif st.session_state.app_state == "processing":
         st.stop()
 
     # Check chunk limit
-    current_chunks = len(st.session_state.index_data)
-    if current_chunks + len(all_chunks) > MAX_CHUNKS:
-        st.warning(f"Chunk limit reached. Trimming to {MAX_CHUNKS} total chunks.")
-        all_chunks = all_chunks[: MAX_CHUNKS - current_chunks]
+    if trimmed:
+        st.warning(
+            f"Chunk or budget limit reached. Keeping the first {len(all_chunks) + len(shared)} new chunks."
+        )
 
-    # Embedding + index building
+    # Index building
     with status:
-        embeddings, embed_cost = create_embeddings_with_progress(all_chunks)
-        st.session_state.session_cost += embed_cost
-        st.write(f"Embedding cost: ${embed_cost:.4f}")
-
         st.write("📦 Building index...")
-        for chunk, emb in zip(all_chunks, embeddings):
-            st.session_state.index_data.append(
-                {
-                    "text": chunk["text"],
-                    "source": chunk["source"],
-                    "chunk_id": chunk["chunk_id"],
-                    "embedding": emb,
-                }
-            )
-            st.session_state.sources.add(chunk["source"])
+        # A fully read new version replaces the old one: chunks that are gone
+        # from it are dropped. Partial reads (limits, errors) only add.
+        if not trimmed:
+            removed = 0
+            for source, rows in existing.items():
+                if rows and source not in file_errors:
+                    removed += st.session_state.index_data.retire_source_rows(
+                        source, kept_hashes[source]
+                    )
+            if removed:
+                st.write(f"🗑️ Removed {removed} outdated chunks")
+        st.session_state.index_data.add(all_chunks, embeddings)
+        st.session_state.sources.update(chunk["source"] for chunk in all_chunks + shared)
+        st.session_state.sources.update(duplicate_sources)
 
     status.update(label="Done!", state="complete")
 
@@ -459,7 +569,7 @@ elif st.session_state.app_state == "chat":
                             if len(src["source"]) < 50
                             else src["source"][:47] + "..."
                         )
-                        st.markdown(f"**{i}.** {src_label} · `{src['similarity']:.3f}`")
+                        st.markdown(f"**{i}.** {src_label} · `{score_label(src)}`")
                         st.caption(src["text"][:200] + "...")
 
     # ---- Chat input ----
@@ -476,39 +586,58 @@ elif st.session_state.app_state == "chat":
 
             # Assistant message
             with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    from retrieval import retrieve_relevant_chunks, classify_retrieval
-                    from rag_pipeline import generate_answer, classify_generation
-                    from error_logger import log_query
-
-                    from query_rewriter import rewrite_query
+                from query_pipeline import run_query
+                from diagnostics import submit_diagnostics
+                from answer_cache import get_answer_cache
 
-                    rewritten_query, rewrite_cost = rewrite_query(user_input)
-                    st.session_state.session_cost += rewrite_cost
+                answer_cache = get_answer_cache()
 
-                    chunks, retrieval_cost = retrieve_relevant_chunks(
-                        rewritten_query, st.session_state.index_data, top_k=3
+                with st.spinner("Thinking..."):
+                    result = run_query(
+                        user_input,
+                        st.session_state.index_data,
+                        top_k=3,
+                        stream=True,
+                        classify=False,
+                        answer_cache=answer_cache,
+                        speculative=True,
+                    )
+                    st.session_state.session_cost += result["cost"]
+                    chunks = result["chunks"]
+
+                if isinstance(result["answer"], str):
+                    # Cached answer, or retrieval failed and the answer is a
+                    # helpful redirect
+                    answer = result["answer"]
+                    st.markdown(answer)
+                    if result["cached"]:
+                        st.caption("⚡ Answered from cache")
+                else:
+                    # Stream the answer token by token as it is generated
+                    stream = result["answer"]
+                    st.write_stream(stream)
+                    answer = stream.text
+                    st.session_state.session_cost += stream.cost
+                    answer_cache.put(
+                        user_input,
+                        st.session_state.index_data,
+                        result,
+                        answer=answer,
+                        embedding=result["question_embedding"],
                     )
 
-                    answer, llm_cost = generate_answer(user_input, chunks)
-                    st.session_state.session_cost += retrieval_cost + llm_cost
-
-                    # Classify and log
-                    retrieval_class = classify_retrieval(chunks)
-                    generation_class = classify_generation(user_input, chunks, answer)
-                    # If retrieval failed, override answer with helpful redirect
-                    if retrieval_class["status"] == "failed":
-                        answer = handle_refusal(user_input, chunks)
-                    log_entry = log_query(
+                # Classify and log in the background; the answer is already
+                # shown. Cache hits were logged when first answered.
+                if not result["cached"]:
+                    submit_diagnostics(
                         user_input,
-                        rewritten_query,
-                        retrieval_class,
-                        generation_class,
+                        result["rewritten_query"],
+                        result["retrieval_class"],
                         chunks,
                         answer,
+                        generation_class=result["generation_class"],
                     )
 
-                st.markdown(answer)
                 with st.expander("📎 Sources"):
                     for i, src in enumerate(chunks, 1):
                         src_label = (
@@ -516,7 +645,7 @@ elif st.session_state.app_state == "chat":
                             if len(src["source"]) < 50
                             else src["source"][:47] + "..."
                         )
-                        st.markdown(f"**{i}.** {src_label} · `{src['similarity']:.3f}`")
+                        st.markdown(f"**{i}.** {src_label} · `{score_label(src)}`")
                         st.caption(src["text"][:200] + "...")
 
             st.session_state.messages.append(
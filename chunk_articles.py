@@ -1,45 +1,211 @@
-def chunk_article(text, filename):
-    """Split article text into paragraph chunks."""
+from tokenizer import count_tokens, decode, encode
+
+# text-embedding-3-small rejects inputs over 8191 tokens; leave headroom for
+# re-encoding differences when a long paragraph is cut by tokens
+MAX_CHUNK_TOKENS = 8000
+
+
+def split_by_tokens(text, max_tokens=MAX_CHUNK_TOKENS):
+    """Split text into consecutive pieces of at most max_tokens tokens."""
+    tokens = encode(text)
+    if len(tokens) <= max_tokens:
+        return [text]
+    pieces = (decode(tokens[i : i + max_tokens]).strip() for i in range(0, len(tokens), max_tokens))
+    return [piece for piece in pieces if piece]
+
+
+def iter_lines(parts):
+    """Yield lines from an iterable of text pieces (e.g. PDF pages).
+
+    Pieces are treated as one continuous string, so a line that straddles
+    two pieces comes out whole.
+    """
+    tail = ""
+    for part in parts:
+        lines = (tail + part).split("\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
 
-    # Replace single newlines with spaces (joins broken lines)
-    # But keep actual paragraph breaks
-    lines = text.split("\n")
+def iter_article_chunks(parts, filename, max_tokens=MAX_CHUNK_TOKENS):
+    """Lazily split article text, given as an iterable of pieces, into paragraph chunks.
 
-    chunks = []
-    current_chunk = ""
+    A paragraph that would pass max_tokens is cut at a line boundary (or,
+    for a single huge line, by tokens), so text without sentence endings
+    such as CSV rows never becomes an input the embedding API rejects.
+    """
+    chunk_id = 0
+    current_lines = []
+    current_len = 0  # length of " ".join(current_lines)
+    current_tokens = 0
 
-    for line in lines:
+    def make_chunks(lines):
+        nonlocal chunk_id
+        for text in split_by_tokens(" ".join(lines), max_tokens):
+            yield {
+                "text": text,
+                "source": filename,
+                "chunk_id": chunk_id,
+                "tokens": count_tokens(text),
+            }
+            chunk_id += 1
+
+    for line in iter_lines(parts):
         line = line.strip()
 
         # Skip empty lines or obvious metadata
         if not line or len(line) < 10:
             continue
-        if "min. read" in line.lower() or "view original" in line.lower():
+        lowered = line.lower()
+        if "min. read" in lowered or "view original" in lowered:
             continue
 
+        line_tokens = count_tokens(line)
+        if current_lines and current_tokens + line_tokens > max_tokens:
+            yield from make_chunks(current_lines)
+            current_lines = []
+            current_len = 0
+            current_tokens = 0
+
         # Add line to current chunk
-        current_chunk += " " + line
+        current_len += len(line) + (1 if current_lines else 0)
+        current_tokens += line_tokens
+        current_lines.append(line)
 
         # Check if this looks like end of paragraph
         # (ends with punctuation and is long enough)
-        if line.endswith((".", "!", "?", '"', "'")):
-            if len(current_chunk.strip()) > 100:
-                chunks.append(
-                    {
-                        "text": current_chunk.strip(),
-                        "source": filename,
-                        "chunk_id": len(chunks),
-                    }
-                )
-                current_chunk = ""
+        if line.endswith((".", "!", "?", '"', "'")) and current_len > 100:
+            yield from make_chunks(current_lines)
+            current_lines = []
+            current_len = 0
+            current_tokens = 0
 
     # Add last chunk if it exists
-    if len(current_chunk.strip()) > 100:
-        chunks.append(
-            {"text": current_chunk.strip(), "source": filename, "chunk_id": len(chunks)}
-        )
+    if current_len > 100:
+        yield from make_chunks(current_lines)
+
+
+def iter_window_chunks(parts, source, chunk_size=500, overlap=50):
+    """Lazily split text into fixed-size character windows that overlap.
+
+    Windows start every chunk_size - overlap characters; whitespace-only
+    windows are skipped. Only about one window of text is buffered at a time.
+    """
+    step = chunk_size - overlap
+    if step <= 0:
+        raise ValueError("overlap must be smaller than chunk_size")
+
+    chunk_id = 0
+    buffer = ""
+    pos = 0  # start of the next window within buffer
+
+    def window():
+        nonlocal chunk_id
+        body = buffer[pos : pos + chunk_size]
+        if body.strip():
+            chunk_id += 1
+            return {
+                "text": body,
+                "source": source,
+                "chunk_id": chunk_id - 1,
+                "tokens": count_tokens(body),
+            }
+        return None
+
+    for part in parts:
+        buffer = buffer[pos:] + part
+        pos = 0
+        while len(buffer) - pos >= chunk_size:
+            chunk = window()
+            if chunk:
+                yield chunk
+            pos += step
+
+    # Trailing (shorter) windows
+    while pos < len(buffer):
+        chunk = window()
+        if chunk:
+            yield chunk
+        pos += step
 
-    return chunks
+
+def iter_token_chunks(parts, source, chunk_tokens=256, overlap_tokens=32, min_tokens=32):
+    """Lazily split text into chunks of exactly chunk_tokens tokens.
+
+    Lines are stripped and encoded one at a time; a chunk is cut every
+    chunk_tokens tokens with overlap_tokens carried into the next one. The
+    final chunk is dropped if it adds fewer than min_tokens tokens beyond
+    that overlap and other chunks exist, so documents don't end in tiny
+    fragments that cost a request slot.
+    """
+    step = chunk_tokens - overlap_tokens
+    if step <= 0:
+        raise ValueError("overlap_tokens must be smaller than chunk_tokens")
+
+    chunk_id = 0
+    buffer = []
+    pos = 0  # start of the next chunk within buffer
+    fresh = 0  # tokens in buffer not yet covered by an emitted chunk
+
+    def make_chunk(tokens):
+        text = decode(tokens).strip()
+        return {
+            "text": text,
+            "source": source,
+            "chunk_id": chunk_id,
+            "tokens": count_tokens(text),
+        }
+
+    for line in iter_lines(parts):
+        line = line.strip()
+        if not line:
+            continue
+        encoded = encode(line + "\n")
+        buffer = buffer[pos:] + encoded
+        pos = 0
+        fresh += len(encoded)
+        while len(buffer) - pos >= chunk_tokens:
+            yield make_chunk(buffer[pos : pos + chunk_tokens])
+            chunk_id += 1
+            pos += step
+            fresh = len(buffer) - pos - overlap_tokens
+
+    tail = buffer[pos:]
+    if tail and decode(tail[-1:]) == "\n":
+        fresh -= 1  # the line break appended to the last line isn't content
+    if fresh > 0 and (fresh >= min_tokens or chunk_id == 0):
+        yield make_chunk(tail)
+
+
+CHUNK_STRATEGIES = {
+    "paragraph": iter_article_chunks,
+    "window": iter_window_chunks,
+    "tokens": iter_token_chunks,
+}
+
+
+def iter_chunks(parts, source, strategy="paragraph", **options):
+    """Lazily chunk text with the named strategy.
+
+    parts is a string or any iterable of text pieces (lines, PDF pages,
+    streamed downloads). Chunks are yielded as soon as they are complete.
+    """
+    if isinstance(parts, str):
+        parts = [parts]
+    try:
+        chunker = CHUNK_STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown chunking strategy: {strategy}")
+    return chunker(parts, source, **options)
+
+
+def chunk_article(text, filename):
+    """Split article text into paragraph chunks."""
+    # Single newlines within a paragraph are joined with spaces; a chunk
+    # ends at a punctuation-terminated line once it is long enough
+    return list(iter_chunks(text, filename, strategy="paragraph"))
 
 
 def chunk_all_articles(articles):
@@ -0,0 +1,334 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import deque
+
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Connection pool: enough sockets for many concurrent queries, kept alive so
+# requests skip the TCP/TLS handshake. Shared by every module in the process.
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 50
+KEEPALIVE_EXPIRY_SECONDS = 30
+REQUEST_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Retry policy for 429 / 5xx / connection errors (the SDK's own is off)
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+
+# Circuit breaker: after this many transient failures in a row, fail fast
+# for BREAKER_RESET_SECONDS, then let one trial call through
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30.0
+
+# Pricing per token: model -> (input, output)
+PRICING = {
+    "gpt-4o-mini": (0.15 / 1_000_000, 0.60 / 1_000_000),
+    "text-embedding-3-small": (0.02 / 1_000_000, 0.0),
+}
+
+LATENCY_WINDOW = 1_000  # recent calls per stage kept for percentiles
+
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff before retry number attempt + 1."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))
+
+
+def token_cost(model, prompt_tokens, completion_tokens=0):
+    """Dollar cost of a number of input and output tokens."""
+    input_price, output_price = PRICING.get(model, (0.0, 0.0))
+    return prompt_tokens * input_price + completion_tokens * output_price
+
+
+def usage_cost(model, usage):
+    """Dollar cost of a response's usage (chat or embeddings)."""
+    if usage is None:
+        return 0.0
+    return token_cost(
+        model, usage.prompt_tokens or 0, getattr(usage, "completion_tokens", 0) or 0
+    )
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling the API after repeated transient failures.
+
+    Closed: calls go through. After failure_threshold transient failures in
+    a row it opens and every call fails immediately with CircuitOpenError.
+    After reset_seconds one trial call is let through (half-open); success
+    closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+            return "half-open"
+
+    def before_call(self):
+        """Raise CircuitOpenError, or return True if this call is the half-open trial."""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_seconds or self._trial_running:
+                raise CircuitOpenError(
+                    f"OpenAI API unavailable after {self._failures} failures; "
+                    f"retrying in {max(self.reset_seconds - waited, 0):.0f}s"
+                )
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def abandon_trial(self):
+        """The trial call ended without an outcome (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class CallMetrics:
+    """Per-stage API call counts, latency, tokens and cost.
+
+    Every call made through this module is recorded under the stage name
+    its caller passes (e.g. "rewrite", "generate", "query_embed").
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def _stage(self, stage):
+        if stage not in self._stages:
+            self._stages[stage] = {
+                "calls": 0,
+                "errors": 0,
+                "retries": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost": 0.0,
+                "latency_seconds": 0.0,
+                "recent": deque(maxlen=self.window),
+            }
+        return self._stages[stage]
+
+    def record(self, stage, latency, retries=0, error=False):
+        with self._lock:
+            entry = self._stage(stage)
+            entry["calls"] += 1
+            entry["errors"] += int(error)
+            entry["retries"] += retries
+            entry["latency_seconds"] += latency
+            entry["recent"].append(latency)
+
+    def add_usage(self, stage, model, usage):
+        """Count a response's tokens and cost (streams report it at the end)."""
+        if usage is None:
+            return
+        with self._lock:
+            entry = self._stage(stage)
+            entry["prompt_tokens"] += usage.prompt_tokens or 0
+            entry["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+            entry["cost"] += usage_cost(model, usage)
+
+    def snapshot(self):
+        """Totals per stage, with mean / p50 / p95 latency in seconds."""
+        with self._lock:
+            result = {}
+            for stage, entry in self._stages.items():
+                recent = sorted(entry["recent"])
+                result[stage] = {
+                    key: value for key, value in entry.items() if key != "recent"
+                }
+                result[stage]["mean_latency"] = entry["latency_seconds"] / max(entry["calls"], 1)
+                result[stage]["p50_latency"] = recent[len(recent) // 2] if recent else 0.0
+                result[stage]["p95_latency"] = recent[int(len(recent) * 0.95)] if recent else 0.0
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+breaker = CircuitBreaker()
+metrics = CallMetrics()
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+_async_clients_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide OpenAI client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(
+                timeout=REQUEST_TIMEOUT,
+                max_retries=0,
+                http_client=DefaultHttpxClient(limits=_limits(), timeout=REQUEST_TIMEOUT),
+            )
+        return _client
+
+
+def get_async_client():
+    """Return the shared AsyncOpenAI client for the running event loop.
+
+    httpx connections belong to the loop that opened them, so each loop
+    gets one client (a long-running service has exactly one).
+    """
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                timeout=REQUEST_TIMEOUT,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=REQUEST_TIMEOUT),
+            )
+            _async_clients[loop] = client
+        return client
+
+
+def call(stage, create, before_attempt=None, max_retries=MAX_RETRIES, **kwargs):
+    """Call create(**kwargs) under the shared retry, breaker and metrics policy.
+
+    before_attempt() runs before every attempt (e.g. to take rate-limit
+    tokens). Streaming responses have no usage yet; report it later with
+    metrics.add_usage.
+    """
+    start = time.monotonic()
+    for attempt in range(max_retries + 1):
+        try:
+            trial = breaker.before_call()
+        except CircuitOpenError:
+            metrics.record(stage, time.monotonic() - start, retries=attempt, error=True)
+            raise
+        try:
+            if before_attempt is not None:
+                before_attempt()
+            response = create(**kwargs)
+        except Exception as e:
+            retryable = is_retryable(e)
+            if retryable:
+                breaker.record_failure()
+            else:
+                breaker.record_success()  # the API answered; the request was bad
+            if not retryable or attempt == max_retries:
+                metrics.record(stage, time.monotonic() - start, retries=attempt, error=True)
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        except BaseException:
+            # Interrupted (KeyboardInterrupt etc.): no verdict on the API, but
+            # a trial must not stay "running" or the breaker never closes
+            if trial:
+                breaker.abandon_trial()
+            raise
+        breaker.record_success()
+        metrics.record(stage, time.monotonic() - start, retries=attempt)
+        metrics.add_usage(stage, kwargs.get("model"), getattr(response, "usage", None))
+        return response
+
+
+async def call_async(stage, create, max_retries=MAX_RETRIES, **kwargs):
+    """Async call(): same policy, awaiting create(**kwargs)."""
+    start = time.monotonic()
+    for attempt in range(max_retries + 1):
+        try:
+            trial = breaker.before_call()
+        except CircuitOpenError:
+            metrics.record(stage, time.monotonic() - start, retries=attempt, error=True)
+            raise
+        try:
+            response = await create(**kwargs)
+        except Exception as e:
+            retryable = is_retryable(e)
+            if retryable:
+                breaker.record_failure()
+            else:
+                breaker.record_success()  # the API answered; the request was bad
+            if not retryable or attempt == max_retries:
+                metrics.record(stage, time.monotonic() - start, retries=attempt, error=True)
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        except BaseException:
+            # Cancelled (asyncio.CancelledError is not an Exception)
+            if trial:
+                breaker.abandon_trial()
+            raise
+        breaker.record_success()
+        metrics.record(stage, time.monotonic() - start, retries=attempt)
+        metrics.add_usage(stage, kwargs.get("model"), getattr(response, "usage", None))
+        return response
+
+
+def create_chat_completion(stage, **kwargs):
+    return call(stage, get_client().chat.completions.create, **kwargs)
+
+
+def create_embedding(stage, client=None, **kwargs):
+    client = client or get_client()
+    return call(stage, client.embeddings.create, **kwargs)
+
+
+async def create_chat_completion_async(stage, **kwargs):
+    return await call_async(stage, get_async_client().chat.completions.create, **kwargs)
+
+
+async def create_embedding_async(stage, **kwargs):
+    return await call_async(stage, get_async_client().embeddings.create, **kwargs)
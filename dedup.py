@@ -0,0 +1,109 @@
+import hashlib
+import re
+
+import numpy as np
+
+# MinHash + LSH settings. 16 bands of 4 rows put the LSH candidate threshold
+# near 0.5 Jaccard; candidates are then checked against SIMILARITY_THRESHOLD.
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+SIMILARITY_THRESHOLD = 0.75
+
+_PRIME = np.uint64(4294967291)  # largest prime below 2**32
+_rng = np.random.default_rng(20240219)
+_A = _rng.integers(1, 2**31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2**31, size=NUM_PERM, dtype=np.uint64)
+
+
+def shingles(text):
+    """Set of overlapping word n-grams (lowercased, punctuation ignored)."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)}
+    return {
+        " ".join(words[i : i + SHINGLE_WORDS])
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def minhash(text):
+    """NUM_PERM-value MinHash signature of the text's shingle set."""
+    hashes = np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+            for s in shingles(text)
+        ),
+        dtype=np.uint64,
+    )
+    # (a * x + b) mod p for every permutation and shingle; stays below 2**64
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % _PRIME
+    return permuted.min(axis=1)
+
+
+def estimated_similarity(sig1, sig2):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return float(np.mean(sig1 == sig2))
+
+
+class Deduplicator:
+    """Finds near-duplicate chunks across everything registered so far.
+
+    Kept chunks get a "sources" list; when a later chunk is a near-duplicate
+    its source is appended there instead of storing a second copy. A kept
+    chunk whose "sources" has been emptied (its sources were re-ingested
+    without it) no longer matches anything.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._signatures = []
+        self._chunks = []
+        self._buckets = [{} for _ in range(BANDS)]
+
+    def _bands(self, signature):
+        for b in range(BANDS):
+            yield b, signature[b * ROWS_PER_BAND : (b + 1) * ROWS_PER_BAND].tobytes()
+
+    def find(self, chunk, exclude_hashes=()):
+        """Return (kept_chunk, signature); kept_chunk is None if chunk is new.
+
+        Kept chunks whose "hash" is in exclude_hashes never match, e.g. the
+        old chunks of a source being re-ingested: an edited paragraph is
+        near-identical to its previous version but must replace it.
+        """
+        signature = minhash(chunk["text"])
+        seen = set()
+        for b, key in self._bands(signature):
+            for i in self._buckets[b].get(key, ()):
+                if i in seen:
+                    continue
+                seen.add(i)
+                if not self._chunks[i]["sources"]:
+                    continue
+                if self._chunks[i].get("hash") in exclude_hashes:
+                    continue
+                if estimated_similarity(signature, self._signatures[i]) >= self.threshold:
+                    return self._chunks[i], signature
+        return None, signature
+
+    def register(self, chunk, signature=None):
+        """Add a kept chunk to the LSH index."""
+        if signature is None:
+            signature = minhash(chunk["text"])
+        chunk.setdefault("sources", [chunk["source"]])
+        i = len(self._chunks)
+        self._chunks.append(chunk)
+        self._signatures.append(signature)
+        for b, key in self._bands(signature):
+            self._buckets[b].setdefault(key, []).append(i)
+
+    def merge(self, kept, duplicate):
+        """Record that duplicate's source also contains kept's text."""
+        if duplicate["source"] not in kept["sources"]:
+            kept["sources"].append(duplicate["source"])
+
+    def forget(self, chunk):
+        """Stop matching a registered chunk, e.g. one that never got indexed."""
+        chunk.get("sources", []).clear()
@@ -0,0 +1,100 @@
+import atexit
+import queue
+import threading
+import traceback
+
+from rag_pipeline import classify_generation
+from error_logger import log_query, flush_log
+
+DRAIN_TIMEOUT_SECONDS = 30  # how long shutdown waits for queued diagnostics
+
+_jobs = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _run_worker():
+    """Classify and log queued queries one at a time, forever."""
+    while True:
+        job = _jobs.get()
+        try:
+            generation_class = job["generation_class"]
+            if generation_class is None:
+                generation_class = classify_generation(
+                    job["question"], job["chunks"], job["answer"]
+                )
+            log_query(
+                job["question"],
+                job["rewritten_query"],
+                job["retrieval_class"],
+                generation_class,
+                job["chunks"],
+                job["answer"],
+            )
+        except Exception:
+            # Diagnostics must never take the worker down
+            traceback.print_exc()
+        finally:
+            _jobs.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run_worker, name="diagnostics-worker", daemon=True
+            )
+            _worker.start()
+
+
+def submit_diagnostics(
+    question,
+    rewritten_query,
+    retrieval_class,
+    chunks,
+    answer,
+    generation_class=None,
+):
+    """Queue generation classification and logging for a finished query.
+
+    Returns immediately; the LLM-as-a-judge call and the log write happen on
+    a background thread. Pass generation_class to skip classification when
+    the outcome is already known.
+    """
+    _ensure_worker()
+    _jobs.put(
+        {
+            "question": question,
+            "rewritten_query": rewritten_query,
+            "retrieval_class": retrieval_class,
+            "chunks": chunks,
+            "answer": answer,
+            "generation_class": generation_class,
+        }
+    )
+
+
+def wait_for_diagnostics(timeout=None):
+    """Block until every queued job is done (or timeout seconds pass).
+
+    Returns:
+        bool: True if the queue drained
+    """
+    done = threading.Event()
+
+    def join():
+        _jobs.join()
+        done.set()
+
+    threading.Thread(target=join, daemon=True).start()
+    return done.wait(timeout)
+
+
+def _drain_on_exit():
+    if wait_for_diagnostics(DRAIN_TIMEOUT_SECONDS):
+        flush_log()
+
+
+# Flush pending diagnostics when the process exits normally
+atexit.register(_drain_on_exit)
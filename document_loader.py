@@ -0,0 +1,58 @@
+import io
+
+import trafilatura
+from PyPDF2 import PdfReader
+
+
+def scrape_url(url):
+    """Fetch and extract article text from a URL."""
+    downloaded = trafilatura.fetch_url(url)
+    if downloaded is None:
+        raise ValueError(f"Could not fetch URL: {url}")
+
+    text = trafilatura.extract(downloaded, include_comments=False, include_tables=True)
+    if not text or len(text.strip()) < 50:
+        raise ValueError("Could not extract meaningful text from this URL")
+
+    return {"text": text, "source": url, "filename": url}
+
+
+def count_pdf_pages(data):
+    """Number of pages in a PDF, without extracting any text."""
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def iter_pdf_pages(data, start=0, stop=None):
+    """Yield the extracted text of PDF pages [start, stop) one at a time."""
+    reader = PdfReader(io.BytesIO(data))
+    for page in reader.pages[start:stop]:
+        page_text = page.extract_text()
+        if page_text:
+            yield page_text
+
+
+def process_file_bytes(name, data):
+    """Extract text from uploaded file bytes (PDF, TXT, CSV, DOC, DOCX)."""
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else ""
+
+    if ext == "pdf":
+        text = "".join(iter_pdf_pages(data))
+
+    elif ext == "txt":
+        text = data.decode("utf-8", errors="ignore")
+
+    elif ext == "csv":
+        text = data.decode("utf-8", errors="ignore")
+
+    elif ext in ("doc", "docx"):
+        import docx
+        doc = docx.Document(io.BytesIO(data))
+        text = "\n".join(p.text for p in doc.paragraphs)
+
+    else:
+        raise ValueError(f"Unsupported file type: .{ext}")
+
+    if not text.strip():
+        raise ValueError(f"No text could be extracted from {name}")
+
+    return {"filename": name, "text": text}
@@ -0,0 +1,80 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from tokenizer import count_tokens
+
+BATCH_WINDOW_SECONDS = 0.005  # wait this long for more queries before sending
+MAX_BATCH_SIZE = 256
+MAX_BATCHES_IN_FLIGHT = 4
+
+
+class QueryEmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into batched calls.
+
+    The first request starts a short window; everything that arrives in it
+    (up to max_batch_size) goes out as one request and each caller gets its
+    own vector back. embed_batch(texts) runs in a worker thread and must
+    return (embeddings, cost) for the whole batch; the cost is split by
+    each text's share of the tokens. Batches are sent on the batcher's own
+    threads, so they never queue behind other blocking work.
+    """
+
+    def __init__(
+        self,
+        embed_batch,
+        window_seconds=BATCH_WINDOW_SECONDS,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_in_flight=MAX_BATCHES_IN_FLIGHT,
+    ):
+        self.embed_batch = embed_batch
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._pending = []
+        self._timer = None
+        self._sending = set()  # the loop only holds weak references to tasks
+        self.batches_sent = 0
+        self.texts_sent = 0
+
+    async def embed(self, text):
+        """Embed one text. Returns (embedding, cost), like retrieval.embed_query."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            loop = asyncio.get_running_loop()
+            embeddings, cost = await loop.run_in_executor(self._executor, self.embed_batch, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches_sent += 1
+        self.texts_sent += len(texts)
+        tokens = [count_tokens(text) for text in texts]
+        total = sum(tokens) or 1
+        for (_, future), embedding, n_tokens in zip(batch, embeddings, tokens):
+            if not future.done():
+                future.set_result((embedding, cost * n_tokens / total))
@@ -0,0 +1,170 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from clients import token_cost
+from tokenizer import count_tokens
+
+CACHE_FILE = "embedding_cache.sqlite3"
+MAX_ENTRIES = 50_000  # ~300MB of text-embedding-3-small vectors
+
+
+def normalize_text(text):
+    """Collapse whitespace so trivially reformatted text shares a cache entry."""
+    return " ".join(text.split())
+
+
+def cache_key(model, text):
+    """Content address for an embedding: hash of model name + normalized text."""
+    payload = f"{model}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache shared by every session and the eval runner.
+
+    Entries live in a SQLite file keyed by content hash. Each entry remembers
+    how many tokens it cost so hits can be reported as dollars saved. When the
+    cache grows past max_entries the least recently used rows are evicted.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                tokens INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, texts):
+        """Look up embeddings for texts.
+
+        Returns:
+            tuple: (found, saved_tokens) where found maps position in texts
+            to its cached embedding
+        """
+        keys = [cache_key(model, text) for text in texts]
+        rows = {}
+        with self._lock:
+            unique = list(set(keys))
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i : i + 500]
+                placeholders = ",".join("?" * len(part))
+                for key, vector, tokens in self._conn.execute(
+                    f"SELECT key, vector, tokens FROM embeddings WHERE key IN ({placeholders})",
+                    part,
+                ):
+                    rows[key] = (np.frombuffer(vector, dtype=np.float32), tokens)
+            if rows:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in rows],
+                )
+                self._conn.commit()
+
+        found = {}
+        saved_tokens = 0
+        for i, key in enumerate(keys):
+            if key in rows:
+                found[i] = rows[key][0]
+                saved_tokens += rows[key][1]
+        return found, saved_tokens
+
+    def put_many(self, model, texts, embeddings, tokens):
+        """Store embeddings along with the tokens each one cost."""
+        now = time.time()
+        records = [
+            (
+                cache_key(model, text),
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+                int(n_tokens),
+                now,
+            )
+            for text, embedding, n_tokens in zip(texts, embeddings, tokens)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, tokens, last_used) VALUES (?, ?, ?, ?)",
+                records,
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop least recently used rows beyond max_entries."""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Return the process-wide cache, opening it on first use."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+def embed_with_cache(texts, embed_batch, model="text-embedding-3-small", cache=None):
+    """Embed texts, sending only cache misses to the API.
+
+    embed_batch(texts) must return (embeddings, total_tokens) for the texts
+    it is given. Identical texts within the call are only embedded once.
+
+    Returns:
+        tuple: (embeddings, stats) where stats has hits, misses, cost and
+        saved_cost
+    """
+    cache = cache or get_embedding_cache()
+    found, saved_tokens = cache.get_many(model, texts)
+
+    # Deduplicate misses by content so repeated paragraphs are paid for once
+    miss_keys = {}
+    for i, text in enumerate(texts):
+        if i not in found:
+            miss_keys.setdefault(cache_key(model, text), []).append(i)
+    miss_texts = [texts[positions[0]] for positions in miss_keys.values()]
+
+    cost = 0.0
+    if miss_texts:
+        embeddings, total_tokens = embed_batch(miss_texts)
+        cost = token_cost(model, total_tokens)
+        cache.put_many(
+            model, miss_texts, embeddings, [count_tokens(t) for t in miss_texts]
+        )
+        for positions, embedding in zip(miss_keys.values(), embeddings):
+            for i in positions:
+                found[i] = embedding
+
+    stats = {
+        "hits": len(texts) - len(miss_texts),
+        "misses": len(miss_texts),
+        "cost": cost,
+        "saved_cost": token_cost(model, saved_tokens),
+    }
+    return [found[i] for i in range(len(texts))], stats
@@ -0,0 +1,168 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from clients import MAX_RETRIES, create_embedding, get_client, token_cost
+from rate_limit import RateLimiter
+from embedding_cache import embed_with_cache
+from tokenizer import count_tokens
+
+EMBED_MODEL = "text-embedding-3-small"
+
+# Batching and throughput limits (tune to the account's OpenAI tier)
+MAX_TOKENS_PER_BATCH = 280_000  # API hard limit is 300k tokens per request
+MAX_INPUTS_PER_BATCH = 2048  # API hard limit on inputs per request
+STREAM_BATCH_TOKENS = 20_000  # smaller batches when texts arrive lazily
+MAX_CONCURRENCY = 4  # batches in flight at once
+REQUESTS_PER_MINUTE = 3_000
+TOKENS_PER_MINUTE = 1_000_000
+
+
+def iter_batches(texts, max_tokens=MAX_TOKENS_PER_BATCH, max_inputs=MAX_INPUTS_PER_BATCH):
+    """Greedily group consecutive texts into batches under the token budget.
+
+    Token counts are exact (see tokenizer.py), so batches can be packed
+    close to the API's per-request limit. texts may be any iterable; each
+    batch is yielded as soon as it is full.
+
+    Yields:
+        tuple: (batch_texts, tokens)
+    """
+    batch = []
+    tokens = 0
+    for text in texts:
+        n = count_tokens(text)
+        if batch and (tokens + n > max_tokens or len(batch) >= max_inputs):
+            yield batch, tokens
+            batch, tokens = [], 0
+        batch.append(text)
+        tokens += n
+    if batch:
+        yield batch, tokens
+
+
+class EmbeddingDispatcher:
+    """Embeds many texts with several rate-limited batches in flight at once."""
+
+    def __init__(
+        self,
+        client,
+        model=EMBED_MODEL,
+        max_concurrency=MAX_CONCURRENCY,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        max_tokens_per_batch=MAX_TOKENS_PER_BATCH,
+        max_retries=MAX_RETRIES,
+    ):
+        # Retries are handled by clients.call, with jitter, so turn off the SDK's own
+        self.client = client.with_options(max_retries=0)
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_retries = max_retries
+        self.request_limiter = RateLimiter(requests_per_minute)
+        self.token_limiter = RateLimiter(tokens_per_minute)
+
+    def _send(self, texts, estimated_tokens):
+        """Embed one batch under the shared retry policy, rate-limiting every attempt."""
+
+        def acquire():
+            self.request_limiter.acquire()
+            self.token_limiter.acquire(estimated_tokens)
+
+        response = create_embedding(
+            "embed_batch",
+            client=self.client,
+            before_attempt=acquire,
+            max_retries=self.max_retries,
+            input=texts,
+            model=self.model,
+        )
+        embeddings = [item.embedding for item in response.data]
+        return embeddings, response.usage.total_tokens
+
+    def _embed_batch(self, texts, cache):
+        """Embed one packed batch, sending only cache misses if a cache is given."""
+
+        def send(misses):
+            return self._send(misses, sum(count_tokens(t) for t in misses))
+
+        if cache is not None:
+            embeddings, stats = embed_with_cache(texts, send, model=self.model, cache=cache)
+            return embeddings, stats
+        embeddings, tokens = send(texts)
+        stats = {
+            "hits": 0,
+            "misses": len(texts),
+            "cost": token_cost(self.model, tokens),
+            "saved_cost": 0.0,
+        }
+        return embeddings, stats
+
+    def embed_stream(self, texts, on_progress=None, cache=None, max_tokens=STREAM_BATCH_TOKENS):
+        """Embed an iterable of texts, sending each batch as soon as it fills.
+
+        texts may be a lazy generator (e.g. chunks coming out of a PDF still
+        being parsed); embedding starts on the first batch while later texts
+        are still being produced. At most 2 x max_concurrency batches are
+        buffered, so a slow API applies back-pressure to the producer.
+
+        on_progress(done_batches, submitted_batches) is called from the
+        calling thread as each batch completes.
+
+        Returns:
+            tuple: (embeddings in input order, stats) where stats has hits,
+            misses, cost and saved_cost
+        """
+        results = {}
+        stats = {"hits": 0, "misses": 0, "cost": 0.0, "saved_cost": 0.0}
+        in_flight = {}
+        done_count = 0
+
+        def collect(done):
+            nonlocal done_count
+            for future in done:
+                embeddings, batch_stats = future.result()
+                results[in_flight.pop(future)] = embeddings
+                for key in stats:
+                    stats[key] += batch_stats[key]
+                done_count += 1
+                if on_progress:
+                    on_progress(done_count, done_count + len(in_flight))
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            for n, (batch, _) in enumerate(iter_batches(texts, max_tokens=max_tokens)):
+                in_flight[pool.submit(self._embed_batch, batch, cache)] = n
+                if len(in_flight) >= 2 * self.max_concurrency:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                else:
+                    done = [future for future in in_flight if future.done()]
+                collect(done)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        embeddings = [emb for n in range(len(results)) for emb in results[n]]
+        return embeddings, stats
+
+    def embed(self, texts, on_progress=None, cache=None):
+        """Embed a list of texts concurrently in API-sized batches.
+
+        Returns:
+            tuple: (embeddings in input order, stats)
+        """
+        return self.embed_stream(
+            texts, on_progress=on_progress, cache=cache, max_tokens=self.max_tokens_per_batch
+        )
+
+
+_default_dispatcher = None
+_default_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher (one set of rate limits), creating it on first use."""
+    global _default_dispatcher
+    with _default_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = EmbeddingDispatcher(get_client())
+        return _default_dispatcher
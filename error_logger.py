@@ -1,8 +1,25 @@
+import atexit
+import glob
 import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 
-LOG_FILE = "error_log.json"
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, single-process logging only
+    fcntl = None
+
+LOG_FILE = "error_log.jsonl"  # one JSON entry per line, append-only
+LEGACY_LOG_FILE = "error_log.json"  # old format: a single JSON array
+
+FLUSH_INTERVAL_SECONDS = 2.0  # max time an entry waits in the buffer
+FLUSH_MAX_ENTRIES = 100  # flush early once this many entries are buffered
+MAX_LOG_BYTES = 10 * 1024 * 1024  # rotate when the live file passes 10MB
+MAX_LOG_AGE_SECONDS = 24 * 60 * 60  # ... or when its first entry is a day old
+MAX_ROTATED_FILES = 10  # oldest rotated files beyond this are deleted
 
 
 def log_query(
@@ -25,7 +42,10 @@ def log_query(
             "top_score": retrieval_classification["top_score"],
             "sources_retrieved": [c["source"] for c in top_chunks],
             "scores_per_source": [
-                {"source": c["source"], "score": round(c["similarity"], 4)}
+                {
+                    "source": c["source"],
+                    "score": None if c["similarity"] is None else round(c["similarity"], 4),
+                }
                 for c in top_chunks
             ],
         },
@@ -39,18 +59,7 @@ def log_query(
         "answer_preview": answer[:200],
     }
 
-    # Load existing log or start fresh
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r") as f:
-            log = json.load(f)
-    else:
-        log = []
-
-    log.append(entry)
-
-    with open(LOG_FILE, "w") as f:
-        json.dump(log, f, indent=2)
-
+    _get_writer().write(entry)
     return entry
 
 
@@ -72,3 +81,141 @@ def _classify_overall(retrieval_result, generation_result):
         return "generation_uncertain"
     else:
         return "none"
+
+
+# ==========================================
+# JSONL BACKEND
+# ==========================================
+def _rotated_files(path):
+    """Rotated siblings of path, oldest first."""
+    stem, ext = os.path.splitext(path)
+    return sorted(glob.glob(f"{stem}.*{ext}"))
+
+
+def _first_timestamp(path):
+    with open(path, "r") as f:
+        line = f.readline()
+    try:
+        return datetime.fromisoformat(json.loads(line)["timestamp"])
+    except (ValueError, KeyError):
+        return None
+
+
+def _needs_rotation(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+    if os.path.getsize(path) >= MAX_LOG_BYTES:
+        return True
+    started = _first_timestamp(path)
+    return (
+        started is not None
+        and (datetime.now() - started).total_seconds() >= MAX_LOG_AGE_SECONDS
+    )
+
+
+def _rotate(path):
+    stem, ext = os.path.splitext(path)
+    os.replace(path, f"{stem}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ext}")
+    for old in _rotated_files(path)[:-MAX_ROTATED_FILES]:
+        os.remove(old)
+
+
+class _LogWriter:
+    """Buffers log entries and appends them from a background thread.
+
+    Each flush takes an exclusive lock on a sidecar lock file, rotates the
+    live file if it is too big or too old, then appends the buffered lines.
+    Locking the sidecar (not the log itself) keeps other processes from
+    appending to a file that has just been rotated away.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="error-log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, entry):
+        self._queue.put(json.dumps(entry, ensure_ascii=False))
+
+    def flush(self):
+        """Block until everything written so far is on disk."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            # Collect whatever else arrives within the flush window, which
+            # starts with the first entry (not the latest one)
+            deadline = time.monotonic() + FLUSH_INTERVAL_SECONDS
+            try:
+                while len(lines) < FLUSH_MAX_ENTRIES:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    lines.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                pass
+            try:
+                self._append(lines)
+            except Exception as e:
+                print(f"error_logger: failed to write {len(lines)} entries: {e}")
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    def _append(self, lines):
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if _needs_rotation(self.path):
+                    _rotate(self.path)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _LogWriter(LOG_FILE)
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def flush_log():
+    """Wait until all logged entries have been written to disk."""
+    if _writer is not None:
+        _writer.flush()
+
+
+def read_log(path=LOG_FILE, include_rotated=True):
+    """Lazily yield log entries, oldest first.
+
+    Reads the legacy JSON array (if present), then rotated files, then the
+    live file, one line at a time so memory use stays flat.
+    """
+    if include_rotated and os.path.exists(LEGACY_LOG_FILE):
+        with open(LEGACY_LOG_FILE, "r") as f:
+            yield from json.load(f)
+
+    paths = _rotated_files(path) if include_rotated else []
+    if os.path.exists(path):
+        paths.append(path)
+
+    for p in paths:
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
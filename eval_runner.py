@@ -1,29 +1,43 @@
+import asyncio
 import json
 import os
-import time
 import requests
 from bs4 import BeautifulSoup
-from openai import OpenAI
-from dotenv import load_dotenv
 
-from retrieval import retrieve_relevant_chunks, classify_retrieval
-from rag_pipeline import generate_answer, classify_generation, handle_refusal
-from query_rewriter import rewrite_query
-
-load_dotenv()
-client = OpenAI()
+from query_pipeline import run_query_async
+from answer_cache import get_answer_cache
+from clients import create_chat_completion, create_chat_completion_async, get_client, metrics
+from chunk_articles import iter_chunks
+from vector_index import VectorIndex
+from embedding_cache import get_embedding_cache
+from embedding_dispatcher import EmbeddingDispatcher
+from rate_limit import RateLimiter
 
 # ==========================================
 # CONFIG
 # ==========================================
 EVAL_SET_FILE = "eval_set.json"
 RESULTS_FILE = "eval_results.json"
+INDEX_DIR = "eval_index"  # saved index; delete to force a rebuild
 SOURCE_URL = "https://en.wikipedia.org/wiki/States_and_union_territories_of_India"
 
-EMBED_COST_PER_TOKEN = 0.02 / 1_000_000  # text-embedding-3-small
 CHUNK_SIZE = 500  # characters per chunk
 CHUNK_OVERLAP = 50  # overlap between chunks
 
+# Saved with the index; a saved index built with other settings is rebuilt
+INDEX_PARAMS = {
+    "source_url": SOURCE_URL,
+    "strategy": "window",
+    "chunk_size": CHUNK_SIZE,
+    "chunk_overlap": CHUNK_OVERLAP,
+}
+
+EVAL_CONCURRENCY = 8  # test cases in flight at once
+EVAL_CASES_PER_MINUTE = 100  # ~5 LLM/embedding calls each; tune to the account's tier
+# Off by default: cache hits skip the pipeline and its embedding lookups go
+# unmeasured, which would skew the latency and quality being evaluated
+EVAL_USE_ANSWER_CACHE = False
+
 
 # ==========================================
 # STEP 1: SCRAPE
@@ -50,26 +64,11 @@ def scrape_url(url):
 # ==========================================
 def chunk_text(text, source, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     """Split text into overlapping chunks."""
-    chunks = []
-    start = 0
-    chunk_id = 0
-
-    while start < len(text):
-        end = start + chunk_size
-        chunk_body = text[start:end]
-
-        if chunk_body.strip():
-            chunks.append(
-                {
-                    "text": chunk_body,
-                    "source": source,
-                    "chunk_id": chunk_id,
-                }
-            )
-            chunk_id += 1
-
-        start += chunk_size - overlap
-
+    chunks = list(
+        iter_chunks(
+            text, source, strategy="window", chunk_size=chunk_size, overlap=overlap
+        )
+    )
     print(f"Created {len(chunks)} chunks")
     return chunks
 
@@ -78,31 +77,25 @@ def chunk_text(text, source, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
 # STEP 3: EMBED + BUILD INDEX
 # ==========================================
 def build_index(chunks):
-    """Embed all chunks and build the index_data list."""
+    """Embed all chunks and build the VectorIndex."""
     print(f"Embedding {len(chunks)} chunks...")
-    index_data = []
-    total_cost = 0.0
 
-    for i, chunk in enumerate(chunks):
-        response = client.embeddings.create(
-            input=chunk["text"], model="text-embedding-3-small"
-        )
-        embedding = response.data[0].embedding
-        cost = response.usage.total_tokens * EMBED_COST_PER_TOKEN
-        total_cost += cost
-
-        index_data.append(
-            {
-                "text": chunk["text"],
-                "source": chunk["source"],
-                "chunk_id": chunk["chunk_id"],
-                "embedding": embedding,
-            }
-        )
+    def report(done, total):
+        print(f"  Embedded batch {done}/{total}")
 
-        if (i + 1) % 20 == 0:
-            print(f"  Embedded {i + 1}/{len(chunks)} chunks...")
+    dispatcher = EmbeddingDispatcher(get_client())
+    embeddings, stats = dispatcher.embed(
+        [c["text"] for c in chunks], on_progress=report, cache=get_embedding_cache()
+    )
+    total_cost = stats["cost"]
+
+    index_data = VectorIndex()
+    index_data.add(chunks, embeddings)
 
+    print(
+        f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"(saved ${stats['saved_cost']:.4f})"
+    )
     print(f"Index built. Embedding cost: ${total_cost:.4f}")
     return index_data, total_cost
 
@@ -110,82 +103,127 @@ def build_index(chunks):
 # ==========================================
 # STEP 4: RUN EVAL
 # ==========================================
-def run_evaluation(index_data, eval_set):
-    """Run each test case through the pipeline and collect results."""
-    results = []
-    total_cost = 0.0
-
-    for i, test_case in enumerate(eval_set):
-        print(f"\n[{i + 1}/{len(eval_set)}] Q: {test_case['question']}")
-
-        # Query rewriting
-        start = time.time()
-        rewritten_query, rewrite_cost = rewrite_query(test_case["question"])
-        rewrite_time = time.time() - start
-        total_cost += rewrite_cost
-
-        # Retrieval
-        start = time.time()
-        chunks, retrieval_cost = retrieve_relevant_chunks(
-            rewritten_query, index_data, top_k=3
-        )
-        retrieval_time = time.time() - start
-        total_cost += retrieval_cost
-
-        # Classification
-        retrieval_class = classify_retrieval(chunks)
-
-        # Generation — default to 0 in case retrieval failed
-        generation_time = 0.0
-        if retrieval_class["status"] == "failed":
-            actual_answer = handle_refusal(test_case["question"], chunks)
-        else:
-            start = time.time()
-            actual_answer, llm_cost = generate_answer(test_case["question"], chunks)
-            generation_time = time.time() - start
-            total_cost += llm_cost
-
-        generation_class = classify_generation(
-            test_case["question"], chunks, actual_answer
-        )
+def _case_result(test_case, outcome, score, score_reason):
+    rewrite_time = outcome["latency"]["rewrite_seconds"]
+    retrieval_time = outcome["latency"]["retrieval_seconds"]
+    generation_time = outcome["latency"]["generation_seconds"]
+    return {
+        "id": test_case["id"],
+        "question": test_case["question"],
+        "expected_answer": test_case["expected_answer"],
+        "should_answer": test_case["should_answer"],
+        "rewritten_query": outcome["rewritten_query"],
+        "actual_answer": outcome["answer"],
+        "retrieval_status": outcome["retrieval_class"]["status"],
+        "retrieval_score": outcome["retrieval_class"]["top_score"],
+        "generation_status": outcome["generation_class"]["status"],
+        "score": score,
+        "score_reason": score_reason,
+        "cached": outcome["cached"],
+        "retrieval_path": outcome["retrieval_path"],
+        "latency": {
+            "rewrite_seconds": round(rewrite_time, 3),
+            "retrieval_seconds": round(retrieval_time, 3),
+            "generation_seconds": round(generation_time, 3),
+            "total_seconds": round(rewrite_time + retrieval_time + generation_time, 3),
+        },
+    }
 
-        # Score using LLM-as-a-judge
-        score, score_reason = score_answer(
-            question=test_case["question"],
-            expected_answer=test_case["expected_answer"],
-            actual_answer=actual_answer,
-            should_answer=test_case["should_answer"],
-        )
 
-        result = {
-            "id": test_case["id"],
-            "question": test_case["question"],
-            "expected_answer": test_case["expected_answer"],
-            "should_answer": test_case["should_answer"],
-            "rewritten_query": rewritten_query,
-            "actual_answer": actual_answer,
-            "retrieval_status": retrieval_class["status"],
-            "retrieval_score": retrieval_class["top_score"],
-            "generation_status": generation_class["status"],
-            "score": score,
-            "score_reason": score_reason,
-            "latency": {
-                "rewrite_seconds": round(rewrite_time, 3),
-                "retrieval_seconds": round(retrieval_time, 3),
-                "generation_seconds": round(generation_time, 3),
-                "total_seconds": round(
-                    rewrite_time + retrieval_time + generation_time, 3
-                ),
-            },
-        }
-
-        results.append(result)
-        print(f"  Score: {score}/5 — {score_reason}")
+def _failed_result(test_case, error):
+    """A case that raised (retries exhausted, breaker open, ...): same keys, no outcome."""
+    return {
+        "id": test_case["id"],
+        "question": test_case["question"],
+        "expected_answer": test_case["expected_answer"],
+        "should_answer": test_case["should_answer"],
+        "rewritten_query": None,
+        "actual_answer": None,
+        "retrieval_status": None,
+        "retrieval_score": None,
+        "generation_status": None,
+        "score": None,
+        "score_reason": None,
+        "cached": None,
+        "retrieval_path": None,
+        "latency": None,
+        "error": f"{type(error).__name__}: {error}",
+    }
+
+
+async def _evaluate_case(index_data, test_case, use_answer_cache):
+    outcome = await run_query_async(
+        test_case["question"],
+        index_data,
+        top_k=3,
+        answer_cache=get_answer_cache() if use_answer_cache else None,
+    )
+
+    # Score using LLM-as-a-judge
+    score, score_reason = await score_answer_async(
+        question=test_case["question"],
+        expected_answer=test_case["expected_answer"],
+        actual_answer=outcome["answer"],
+        should_answer=test_case["should_answer"],
+    )
+    return _case_result(test_case, outcome, score, score_reason), outcome["cost"]
+
+
+async def _run_evaluation_async(
+    index_data, eval_set, concurrency, cases_per_minute, use_answer_cache
+):
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(cases_per_minute)
+    finished = 0
+
+    async def run(test_case):
+        nonlocal finished
+        async with semaphore:
+            await limiter.acquire_async()
+            try:
+                result, cost = await _evaluate_case(index_data, test_case, use_answer_cache)
+            except Exception as e:
+                # One failing case must not throw away every other result
+                result, cost = _failed_result(test_case, e), 0.0
+
+        finished += 1
+        print(f"\n[{finished}/{len(eval_set)}] Q: {result['question']}")
+        if "error" in result:
+            print(f"  FAILED: {result['error']}")
+            return result, cost
+        latency = result["latency"]
+        print(f"  Score: {result['score']}/5 — {result['score_reason']}")
         print(
-            f"  Latency: rewrite={rewrite_time:.2f}s | retrieval={retrieval_time:.2f}s | generation={generation_time:.2f}s"
+            f"  Latency: rewrite={latency['rewrite_seconds']:.2f}s | retrieval={latency['retrieval_seconds']:.2f}s | generation={latency['generation_seconds']:.2f}s"
         )
-
-        time.sleep(0.5)
+        return result, cost
+
+    # gather keeps eval_set order regardless of which case finishes first
+    return await asyncio.gather(*(run(test_case) for test_case in eval_set))
+
+
+def run_evaluation(
+    index_data,
+    eval_set,
+    concurrency=EVAL_CONCURRENCY,
+    cases_per_minute=EVAL_CASES_PER_MINUTE,
+    use_answer_cache=EVAL_USE_ANSWER_CACHE,
+):
+    """Run every test case through the pipeline and collect results.
+
+    Up to `concurrency` cases run at once on the async pipeline, started no
+    faster than cases_per_minute. Results are in eval_set order; a case
+    that raised is kept as a result with an "error" and score None.
+    With use_answer_cache, repeated or paraphrased questions are answered
+    from the process-wide answer cache.
+    """
+    outcomes = asyncio.run(
+        _run_evaluation_async(
+            index_data, eval_set, concurrency, cases_per_minute, use_answer_cache
+        )
+    )
+    results = [result for result, _ in outcomes]
+    total_cost = sum(cost for _, cost in outcomes)
 
     print(f"\nTotal eval cost: ${total_cost:.4f}")
     return results, total_cost
@@ -194,9 +232,7 @@ def run_evaluation(index_data, eval_set):
 # ==========================================
 # STEP 5: SCORE WITH LLM-AS-A-JUDGE
 # ==========================================
-def score_answer(question, expected_answer, actual_answer, should_answer):
-    """Use LLM-as-a-judge to score the actual answer against expected."""
-
+def _score_prompt(question, expected_answer, actual_answer, should_answer):
     if should_answer:
         prompt = f"""You are an answer quality judge. Score the AI's answer from 1 to 5.
 
@@ -228,14 +264,10 @@ Score the AI's response from 1 to 5:
 
 Reply ONLY with a JSON object like:
 {{"score": 4, "reason": "brief explanation"}}"""
+    return prompt
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-        max_tokens=100,
-    )
 
+def _parse_score(response):
     try:
         raw = response.choices[0].message.content.strip()
         result = json.loads(raw)
@@ -244,6 +276,32 @@ Reply ONLY with a JSON object like:
         return 0, f"scoring failed: {str(e)}"
 
 
+def score_answer(question, expected_answer, actual_answer, should_answer):
+    """Use LLM-as-a-judge to score the actual answer against expected."""
+    prompt = _score_prompt(question, expected_answer, actual_answer, should_answer)
+    response = create_chat_completion(
+        "score",
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=100,
+    )
+    return _parse_score(response)
+
+
+async def score_answer_async(question, expected_answer, actual_answer, should_answer):
+    """Async score_answer on the shared AsyncOpenAI client."""
+    prompt = _score_prompt(question, expected_answer, actual_answer, should_answer)
+    response = await create_chat_completion_async(
+        "score",
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+        max_tokens=100,
+    )
+    return _parse_score(response)
+
+
 # ==========================================
 # MAIN
 # ==========================================
@@ -253,25 +311,43 @@ if __name__ == "__main__":
         eval_set = json.load(f)
     print(f"Loaded {len(eval_set)} test cases")
 
-    # Build index
-    raw_text = scrape_url(SOURCE_URL)
-    chunks = chunk_text(raw_text, source=SOURCE_URL)
-    index_data, embed_cost = build_index(chunks)
+    # Build index (or reopen the saved one without re-embedding)
+    index_data = None
+    if os.path.exists(os.path.join(INDEX_DIR, "meta.json")):
+        index_data = VectorIndex.load(INDEX_DIR)
+        if index_data.build_params != INDEX_PARAMS:
+            print(f"Saved index in {INDEX_DIR} was built with other settings; rebuilding")
+            index_data = None
+    if index_data is not None:
+        embed_cost = 0.0
+        print(f"Loaded saved index from {INDEX_DIR} ({len(index_data)} chunks)")
+    else:
+        raw_text = scrape_url(SOURCE_URL)
+        chunks = chunk_text(raw_text, source=SOURCE_URL)
+        index_data, embed_cost = build_index(chunks)
+        index_data.build_params = dict(INDEX_PARAMS)
+        index_data.save(INDEX_DIR)
 
     # Run evaluation
     results, eval_cost = run_evaluation(index_data, eval_set)
 
-    # Summary stats
-    scores = [r["score"] for r in results]
-    avg_score = sum(scores) / len(scores)
+    # Summary stats (failed cases have no score or latency)
+    completed = [r for r in results if "error" not in r]
+    failed = [r for r in results if "error" in r]
+
+    def mean(values):
+        return sum(values) / len(values) if values else 0.0
 
-    all_latencies = [r["latency"]["total_seconds"] for r in results]
-    avg_latency = sum(all_latencies) / len(all_latencies)
+    scores = [r["score"] for r in completed]
+    avg_score = mean(scores)
 
-    retrieval_latencies = [r["latency"]["retrieval_seconds"] for r in results]
+    all_latencies = [r["latency"]["total_seconds"] for r in completed]
+    avg_latency = mean(all_latencies)
+
+    retrieval_latencies = [r["latency"]["retrieval_seconds"] for r in completed]
     generation_latencies = [
         r["latency"]["generation_seconds"]
-        for r in results
+        for r in completed
         if r["latency"]["generation_seconds"] > 0
     ]
 
@@ -284,12 +360,10 @@ if __name__ == "__main__":
             "average_score": round(avg_score, 2),
             "scores": scores,
             "avg_total_latency_seconds": round(avg_latency, 3),
-            "avg_retrieval_latency_seconds": round(
-                sum(retrieval_latencies) / len(retrieval_latencies), 3
-            ),
-            "avg_generation_latency_seconds": round(
-                sum(generation_latencies) / len(generation_latencies), 3
-            ),
+            "avg_retrieval_latency_seconds": round(mean(retrieval_latencies), 3),
+            "avg_generation_latency_seconds": round(mean(generation_latencies), 3),
+            "failed_cases": len(failed),
+            "failed_ids": [r["id"] for r in failed],
         },
         "results": results,
     }
@@ -300,9 +374,16 @@ if __name__ == "__main__":
     print(f"\nResults saved to {RESULTS_FILE}")
     print(f"Average score: {avg_score:.1f}/5")
     print(f"Average total latency: {avg_latency:.2f}s")
-    print(
-        f"Average retrieval latency: {sum(retrieval_latencies) / len(retrieval_latencies):.2f}s"
-    )
-    print(
-        f"Average generation latency: {sum(generation_latencies) / len(generation_latencies):.2f}s"
-    )
+    print(f"Average retrieval latency: {mean(retrieval_latencies):.2f}s")
+    print(f"Average generation latency: {mean(generation_latencies):.2f}s")
+    if failed:
+        print(f"\n{len(failed)}/{len(results)} cases failed:")
+        for r in failed:
+            print(f"  [{r['id']}] {r['error']}")
+
+    print("\nAPI calls by stage:")
+    for stage, stats in sorted(metrics.snapshot().items()):
+        print(
+            f"  {stage:<16} {stats['calls']:>5} calls, {stats['errors']} errors, "
+            f"{stats['retries']} retries, p95 {stats['p95_latency']:.2f}s, ${stats['cost']:.4f}"
+        )
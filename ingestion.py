@@ -0,0 +1,223 @@
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from document_loader import count_pdf_pages, iter_pdf_pages, process_file_bytes
+from chunk_articles import chunk_article, iter_article_chunks
+
+FILE_TIMEOUT_SECONDS = 120  # per-task budget for extraction (+ chunking)
+MIN_PAGES_PER_TASK = 8  # don't split PDFs into ranges smaller than this
+POLL_SECONDS = 0.25
+
+# Workers start from a fresh interpreter and import only this module and
+# its light dependencies. Forking the threaded Streamlit server would copy
+# its locks and clients mid-use.
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+# ==========================================
+# WORKER TASKS (run in child processes)
+# ==========================================
+def extract_and_chunk(name, data):
+    """Extract text from one uploaded file and split it into chunks."""
+    article = process_file_bytes(name, data)
+    return chunk_article(article["text"], article["filename"])
+
+
+def extract_pdf_pages(data, start, stop):
+    """Extract the text of PDF pages [start, stop)."""
+    return list(iter_pdf_pages(data, start, stop))
+
+
+def _is_pdf(name):
+    return name.lower().endswith(".pdf")
+
+
+def _plan_tasks(files, max_workers):
+    """One task per non-PDF file; PDFs are split into page ranges."""
+    tasks = []
+    for i, item in enumerate(files):
+        pages = None
+        if _is_pdf(item["name"]):
+            try:
+                pages = count_pdf_pages(item["bytes"])
+            except Exception:
+                pages = None  # let the whole-file task report the error
+        if not pages:
+            tasks.append({"file": i, "pdf": False})
+            continue
+        per_task = max(MIN_PAGES_PER_TASK, math.ceil(pages / (2 * max_workers)))
+        for start in range(0, pages, per_task):
+            tasks.append(
+                {"file": i, "pdf": True, "start": start, "stop": min(start + per_task, pages)}
+            )
+    return tasks
+
+
+class _TaskRunner:
+    """Runs extraction tasks on a process pool; results are pulled by index.
+
+    A task that runs longer than timeout seconds fails, and the pool is
+    restarted for the unfinished tasks so a hung extraction can't hold a
+    worker hostage. on_task_done(i) is called from the pulling thread.
+    """
+
+    def __init__(self, files, tasks, max_workers, timeout, on_task_done):
+        self.files = files
+        self.tasks = tasks
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.on_task_done = on_task_done
+        self.results = {}  # task index -> (payload, error)
+        self._pool = None
+        self._futures = {}
+
+    def _start_pool(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_MP_CONTEXT)
+        self._futures = {}
+        for i, task in enumerate(self.tasks):
+            if i in self.results:
+                continue
+            item = self.files[task["file"]]
+            if task["pdf"]:
+                future = self._pool.submit(
+                    extract_pdf_pages, item["bytes"], task["start"], task["stop"]
+                )
+            else:
+                future = self._pool.submit(extract_and_chunk, item["name"], item["bytes"])
+            self._futures[future] = i
+        self._order = list(self._futures)
+        self._started = {}
+
+    def _finish(self, i, payload, error):
+        if i in self.results:
+            return  # skipped earlier, or already timed out
+        self.results[i] = (payload, error)
+        self.on_task_done(i)
+
+    def skip(self, i):
+        """Give up on task i: cancel it if it hasn't started and count it as done."""
+        for future, task in self._futures.items():
+            if task == i:
+                future.cancel()
+        self._finish(i, None, None)
+
+    def _poll(self):
+        if self._pool is None:
+            self._start_pool()
+        pending = [f for f in self._futures if self._futures[f] not in self.results]
+        done, _ = wait(pending, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                self._finish(self._futures[future], future.result(), None)
+            except Exception as e:
+                self._finish(self._futures[future], None, str(e))
+
+        # Deadlines count from when a worker picked the task up. Workers take
+        # tasks in submission order, and the pool marks a few queued tasks as
+        # running early, so only count max_workers at once.
+        now = time.monotonic()
+        active = sum(1 for f in self._started if not f.done())
+        for future in self._order:
+            if future.done():
+                continue
+            if future not in self._started and active < self.max_workers and future.running():
+                self._started[future] = now
+                active += 1
+            if future in self._started and now - self._started[future] > self.timeout:
+                self.close(kill=True)
+                self._finish(self._futures[future], None, f"timed out after {self.timeout}s")
+                return
+
+    def result(self, i):
+        """Block (while driving the pool) until task i has finished."""
+        while i not in self.results:
+            self._poll()
+        return self.results[i]
+
+    def close(self, kill=False):
+        if self._pool is None:
+            return
+        # A stuck extraction can't be cancelled; stop the workers outright
+        workers = list((getattr(self._pool, "_processes", None) or {}).values())
+        self._pool.shutdown(wait=not kill, cancel_futures=True)
+        if kill:
+            for process in workers:
+                process.terminate()
+        self._pool = None
+
+
+def iter_file_chunks(files, on_file_done=None, max_workers=None, timeout=FILE_TIMEOUT_SECONDS):
+    """Extract and chunk uploaded files in parallel, yielding chunks as they are ready.
+
+    files is a list of {"name", "bytes"} dicts. Non-PDF files are extracted
+    and chunked in a worker process each. PDFs are split into page ranges
+    that are extracted in parallel; their pages are fed in order into the
+    streaming chunker, so chunks for early pages are yielded (and can be
+    embedded) while later pages are still being parsed.
+
+    Chunks come out in upload order. on_file_done(name, error) is called
+    from the consuming thread as each file finishes (error is None on
+    success). If a PDF page range fails, the file's later ranges are
+    skipped; chunks from the pages before it have already been yielded, so
+    the error says which pages were indexed.
+    """
+    if not files:
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    tasks = _plan_tasks(files, max_workers)
+    max_workers = min(max_workers, len(tasks))
+
+    remaining = {}
+    file_errors = {}  # file -> (first failing page, error)
+    for task in tasks:
+        remaining[task["file"]] = remaining.get(task["file"], 0) + 1
+
+    def file_error(f):
+        if f not in file_errors:
+            return None
+        start, error = file_errors[f]
+        if start:
+            return f"{error} (only pages 1-{start} were indexed)"
+        return error
+
+    def on_task_done(i):
+        task = tasks[i]
+        f = task["file"]
+        error = runner.results[i][1]
+        start = task.get("start", 0)
+        # Chunks stop at the earliest failing range, whatever order ranges fail in
+        if error and (f not in file_errors or start < file_errors[f][0]):
+            file_errors[f] = (start, error)
+        remaining[f] -= 1
+        if remaining[f] == 0 and on_file_done:
+            on_file_done(files[f]["name"], file_error(f))
+
+    runner = _TaskRunner(files, tasks, max_workers, timeout, on_task_done)
+
+    def pdf_pages(task_ids):
+        for n, i in enumerate(task_ids):
+            pages, error = runner.result(i)
+            if error:
+                # Later ranges can't be used; finish them so the file is reported
+                for later in task_ids[n + 1 :]:
+                    runner.skip(later)
+                return
+            yield from pages
+
+    try:
+        for f, item in enumerate(files):
+            task_ids = [i for i, task in enumerate(tasks) if task["file"] == f]
+            if tasks[task_ids[0]]["pdf"]:
+                yield from iter_article_chunks(pdf_pages(task_ids), item["name"])
+            else:
+                chunks, error = runner.result(task_ids[0])
+                if not error:
+                    yield from chunks
+    finally:
+        runner.close()
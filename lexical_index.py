@@ -0,0 +1,107 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+# Okapi BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset(
+    """a an and are as at be by did do does for from has have how in is it its
+    of on or that the their this to was were what when where which who why
+    will with""".split()
+)
+
+
+def tokenize(text):
+    """Lowercased word tokens with stopwords removed."""
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index scoring rows with BM25.
+
+    Row numbers are the caller's (VectorIndex rows), so lexical and dense
+    results can be fused directly. Postings map term -> {row: term count}.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @property
+    def vocabulary(self):
+        """Every indexed term (a live view)."""
+        return self.postings.keys()
+
+    def add(self, row, text):
+        terms = tokenize(text)
+        for term, count in Counter(terms).items():
+            self.postings.setdefault(term, {})[row] = count
+        self.doc_lengths[row] = len(terms)
+        self._total_length += len(terms)
+
+    def remove(self, row, text):
+        if row not in self.doc_lengths:
+            return
+        for term in set(tokenize(text)):
+            rows = self.postings.get(term)
+            if rows is not None:
+                rows.pop(row, None)
+                if not rows:
+                    del self.postings[term]
+        self._total_length -= self.doc_lengths.pop(row)
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def scores(self, query):
+        """BM25 score per matching row for a query string.
+
+        Returns:
+            tuple: (scores, coverage) dicts mapping row to its BM25 score and
+            to the fraction of distinct query terms the row contains
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.doc_lengths:
+            return {}, {}
+        avg_length = self._total_length / len(self) or 1.0
+
+        scores = {}
+        matched = Counter()
+        for term in terms:
+            rows = self.postings.get(term)
+            if not rows:
+                continue
+            idf = self.idf(term)
+            for row, tf in rows.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[row] / avg_length)
+                scores[row] = scores.get(row, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[row] += 1
+        coverage = {row: count / len(terms) for row, count in matched.items()}
+        return scores, coverage
+
+    def top(self, query, top_k):
+        """Top rows as (rows, scores, coverage) arrays, best first."""
+        scores, coverage = self.scores(query)
+        if not scores:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        rows = np.fromiter(scores, dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))
+        k = min(top_k, len(rows))
+        best = np.argpartition(-values, k - 1)[:k]
+        best = best[np.argsort(-values[best])]
+        return (
+            rows[best],
+            values[best],
+            np.array([coverage[row] for row in rows[best]]),
+        )
@@ -0,0 +1,71 @@
+import numpy as np
+
+# In-memory embedding storage modes for VectorIndex, from largest to smallest:
+#   float32  4 bytes/dim
+#   float16  2 bytes/dim
+#   int8     1 byte/dim + one float32 scale per row
+STORAGE_MODES = ("float32", "float16", "int8")
+
+
+def quantize_rows(vectors):
+    """Symmetric per-row int8 quantization: row ~= codes * scale."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class QuantizedMatrix:
+    """int8 matrix with a float32 scale per row.
+
+    Indexing returns dequantized float32 rows, so code that scores blocks
+    or gathers candidate rows works the same as with a plain float array.
+    """
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def empty(cls, rows, dim):
+        return cls(np.empty((rows, dim), dtype=np.int8), np.empty(rows, dtype=np.float32))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        return self.codes[key].astype(np.float32) * self.scales[key][..., None]
+
+    def __setitem__(self, key, vectors):
+        self.codes[key], self.scales[key] = quantize_rows(vectors)
+
+    def head(self, rows):
+        """The first rows, without copying."""
+        return QuantizedMatrix(self.codes[:rows], self.scales[:rows])
+
+    def take(self, rows):
+        """A compact copy of the given rows."""
+        return QuantizedMatrix(self.codes[rows], self.scales[rows])
+
+    def resized(self, capacity, rows):
+        """A copy with room for capacity rows, keeping the first rows."""
+        grown = QuantizedMatrix.empty(capacity, self.shape[1])
+        grown.codes[:rows] = self.codes[:rows]
+        grown.scales[:rows] = self.scales[:rows]
+        return grown
+
+
+def empty_storage(storage, rows, dim):
+    """Backing matrix for a storage mode."""
+    if storage == "int8":
+        return QuantizedMatrix.empty(rows, dim)
+    return np.empty((rows, dim), dtype=storage)
@@ -0,0 +1,415 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from retrieval import (
+    lexical_fast_path,
+    retrieve_relevant_chunks,
+    retrieve_relevant_chunks_async,
+    classify_retrieval,
+    embed_query,
+    embed_query_async,
+)
+from rag_pipeline import (
+    generate_answer,
+    generate_answer_async,
+    generate_answer_stream,
+    classify_generation,
+    classify_generation_async,
+    handle_refusal,
+    handle_refusal_async,
+)
+from query_rewriter import needs_llm_rewrite, rewrite_query, rewrite_query_async
+from lexical_index import tokenize
+from vector_index import VectorIndex
+from answer_cache import normalize_question
+
+# Generation outcome when retrieval failed and we redirected instead
+REFUSAL_GENERATION_CLASS = {
+    "status": "refused",
+    "reason": "retrieval failed - redirect returned without generation",
+}
+
+# Speculative retrieval: the raw-question results are kept if the rewrite
+# barely changed the question's terms, or if BM25 on the rewrite agrees
+# with enough of them
+SPECULATIVE_MIN_TERM_OVERLAP = 0.8  # Jaccard of query terms
+SPECULATIVE_MIN_RESULT_OVERLAP = 0.67  # share of speculative chunks BM25 also ranks top
+
+_rewrite_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rewrite")
+
+
+def _term_overlap(a, b):
+    a, b = set(tokenize(a)), set(tokenize(b))
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _speculates(speculative, question, vocabulary):
+    """Whether to retrieve the raw question while an LLM rewrite runs."""
+    return speculative and needs_llm_rewrite(question, vocabulary)
+
+
+def _speculation_holds(question, rewritten_query, chunks, index, top_k):
+    """Whether retrieval results for the raw question also fit its rewrite."""
+    if normalize_question(rewritten_query) == normalize_question(question):
+        return True
+    if _term_overlap(question, rewritten_query) >= SPECULATIVE_MIN_TERM_OVERLAP:
+        return True
+    if not chunks:
+        return False
+    lexical = {hit["text"] for hit in index.lexical_search(rewritten_query, top_k=top_k)}
+    agreed = sum(1 for chunk in chunks if chunk["text"] in lexical)
+    return agreed / len(chunks) >= SPECULATIVE_MIN_RESULT_OVERLAP
+
+
+def _timed_rewrite(question, vocabulary):
+    start = time.time()
+    rewritten_query, cost = rewrite_query(question, vocabulary=vocabulary)
+    return rewritten_query, cost, time.time() - start
+
+
+async def _timed_rewrite_async(question, vocabulary):
+    start = time.time()
+    rewritten_query, cost = await rewrite_query_async(question, vocabulary=vocabulary)
+    return rewritten_query, cost, time.time() - start
+
+
+async def _timed_retrieval_async(question, index, top_k, query_embedding, embed):
+    start = time.time()
+    chunks, cost = await retrieve_relevant_chunks_async(
+        question, index, top_k=top_k, query_embedding=query_embedding, embed=embed
+    )
+    return chunks, cost, time.time() - start
+
+
+def _reusable_embedding(question, query, question_embedding):
+    """question_embedding if query is just the question renormalized, else None."""
+    if question_embedding is not None and normalize_question(query) == normalize_question(question):
+        return question_embedding
+    return None
+
+
+def _wants_question_embedding(answer_cache, question, index, top_k):
+    """Whether to embed the raw question for the paraphrase tier.
+
+    The embedding finds paraphrases now and is stored with this answer so
+    later paraphrases can find it. A strong keyword match will be answered
+    without any embedding, so it doesn't get one.
+    """
+    return answer_cache is not None and lexical_fast_path(question, index, top_k=top_k) is None
+
+
+def _cache_lookup(answer_cache, question, index, cost, start, question_embedding=None):
+    """The cached result for question, or None.
+
+    Without question_embedding this checks the exact tier, with it the
+    paraphrase tier.
+    """
+    if answer_cache is None:
+        return None
+    if question_embedding is None:
+        entry, tier = answer_cache.get(question, index), "exact"
+    else:
+        entry, tier = answer_cache.get_similar(question_embedding, index), "similar"
+    if entry is None:
+        return None
+    return _result(
+        question,
+        entry["rewritten_query"],
+        entry["chunks"],
+        entry["retrieval_class"],
+        entry["answer"],
+        entry["generation_class"],
+        cost,
+        cached=tier,
+        retrieval_path="cached",
+        latency=(0.0, time.time() - start, 0.0),
+    )
+
+
+def _refusal_generation_class(judge_refusals):
+    """Generation class for a refusal redirect (None: let the judge decide)."""
+    return None if judge_refusals else dict(REFUSAL_GENERATION_CLASS)
+
+
+def _result(
+    question,
+    rewritten_query,
+    chunks,
+    retrieval_class,
+    answer,
+    generation_class,
+    cost,
+    cached=None,
+    question_embedding=None,
+    retrieval_path="direct",
+    latency=(0.0, 0.0, 0.0),
+):
+    rewrite_time, retrieval_time, generation_time = latency
+    return {
+        "question": question,
+        "rewritten_query": rewritten_query,
+        "chunks": chunks,
+        "retrieval_class": retrieval_class,
+        "answer": answer,
+        "generation_class": generation_class,
+        "cost": cost,
+        "cached": cached,
+        "question_embedding": question_embedding,
+        "retrieval_path": retrieval_path,
+        "latency": {
+            "rewrite_seconds": rewrite_time,
+            "retrieval_seconds": retrieval_time,
+            "generation_seconds": generation_time,
+        },
+    }
+
+
+def _store(answer_cache, question, index, cache_key, result):
+    """Cache a finished result, unless the index changed while it ran.
+
+    Streamed answers aren't stored; the caller puts them once consumed.
+    """
+    if (
+        answer_cache is not None
+        and isinstance(result["answer"], str)
+        and index.cache_key == cache_key
+    ):
+        answer_cache.put(question, index, result, embedding=result["question_embedding"])
+
+
+def run_query(
+    question,
+    index_data,
+    top_k=3,
+    stream=False,
+    classify=True,
+    judge_refusals=False,
+    answer_cache=None,
+    speculative=False,
+    embed=None,
+):
+    """Run one question through rewrite -> retrieve -> classify -> answer.
+
+    Retrieval is classified before any generation. If it failed, the answer
+    is a refusal redirect and generate_answer is never called. The
+    generation outcome is then already known, so the judge call is skipped
+    too unless judge_refusals=True.
+
+    With stream=True the answer is an AnswerStream (when generation runs);
+    its cost is only known once the caller has consumed it, and it cannot be
+    classified here. In that case, or with classify=False, generation_class
+    is left as None for the caller to fill in (e.g. in the background).
+
+    With an answer_cache, a repeated question (same index version) is
+    answered from the cache with no API calls. Otherwise the question is
+    embedded (one cheap call) to match paraphrases by cosine similarity,
+    unless the lexical fast path will answer it; that embedding is reused
+    for retrieval when the rewrite leaves the question unchanged.
+    A cached answer is always a str and "cached" is "exact" or "similar".
+    Streamed answers are not stored here; the caller puts them once the
+    stream is consumed, passing result["question_embedding"] along.
+
+    With speculative=True, when the rewrite needs the LLM the raw question
+    is retrieved while the rewrite is in flight. The speculative chunks are
+    kept if the rewrite is close enough (see _speculation_holds); otherwise
+    retrieval runs again on the rewrite. retrieval_path records what was
+    used: "direct" (no speculation), "speculative" or "rewritten". The
+    rewrite and retrieval latencies then overlap rather than add up.
+
+    embed(text) -> (embedding, cost) replaces retrieval.embed_query for
+    every query embedding made here, e.g. to batch them across requests.
+
+    Returns:
+        dict: rewritten_query, chunks, retrieval_class, answer,
+        generation_class, cost, cached, question_embedding, retrieval_path
+        and latency (seconds per stage)
+    """
+    cost = 0.0
+    index = VectorIndex.from_index_data(index_data)
+    cache_key = index.cache_key  # answers are only cached if the index didn't change meanwhile
+    embed = embed or embed_query
+
+    start = time.time()
+    question_embedding = None
+    cached = _cache_lookup(answer_cache, question, index, cost, start)
+    if cached is None and _wants_question_embedding(answer_cache, question, index, top_k):
+        question_embedding, embed_cost = embed(question)
+        cost += embed_cost
+        cached = _cache_lookup(answer_cache, question, index, cost, start, question_embedding)
+    if cached is not None:
+        return cached
+
+    # Questions made only of words the corpus uses skip the LLM rewrite
+    vocabulary = index.lexical.vocabulary
+    retrieval_path = "direct"
+    if _speculates(speculative, question, vocabulary):
+        rewrite_future = _rewrite_pool.submit(_timed_rewrite, question, vocabulary)
+
+        start = time.time()
+        chunks, retrieval_cost = retrieve_relevant_chunks(
+            question, index, top_k=top_k, query_embedding=question_embedding, embed=embed
+        )
+        retrieval_time = time.time() - start
+        cost += retrieval_cost
+
+        rewritten_query, rewrite_cost, rewrite_time = rewrite_future.result()
+        cost += rewrite_cost
+        if _speculation_holds(question, rewritten_query, chunks, index, top_k):
+            retrieval_path = "speculative"
+        else:
+            retrieval_path = "rewritten"
+            start = time.time()
+            chunks, retrieval_cost = retrieve_relevant_chunks(
+                rewritten_query, index, top_k=top_k, embed=embed
+            )
+            retrieval_time += time.time() - start
+            cost += retrieval_cost
+    else:
+        rewritten_query, rewrite_cost, rewrite_time = _timed_rewrite(question, vocabulary)
+        cost += rewrite_cost
+
+        start = time.time()
+        chunks, retrieval_cost = retrieve_relevant_chunks(
+            rewritten_query,
+            index,
+            top_k=top_k,
+            query_embedding=_reusable_embedding(question, rewritten_query, question_embedding),
+            embed=embed,
+        )
+        retrieval_time = time.time() - start
+        cost += retrieval_cost
+
+    retrieval_class = classify_retrieval(chunks)
+
+    generation_time = 0.0
+    generation_class = None
+    if retrieval_class["status"] == "failed":
+        answer = handle_refusal(question, chunks)
+        generation_class = _refusal_generation_class(judge_refusals)
+    elif stream:
+        answer = generate_answer_stream(question, chunks)
+    else:
+        start = time.time()
+        answer, llm_cost = generate_answer(question, chunks)
+        generation_time = time.time() - start
+        cost += llm_cost
+
+    if classify and generation_class is None and not stream:
+        generation_class = classify_generation(question, chunks, answer)
+
+    result = _result(
+        question,
+        rewritten_query,
+        chunks,
+        retrieval_class,
+        answer,
+        generation_class,
+        cost,
+        question_embedding=question_embedding,
+        retrieval_path=retrieval_path,
+        latency=(rewrite_time, retrieval_time, generation_time),
+    )
+    _store(answer_cache, question, index, cache_key, result)
+    return result
+
+
+async def run_query_async(
+    question,
+    index_data,
+    top_k=3,
+    classify=True,
+    judge_refusals=False,
+    answer_cache=None,
+    speculative=False,
+    embed=None,
+):
+    """Async run_query (no streaming) on the shared AsyncOpenAI client.
+
+    Same stages, cache handling and result dict as run_query. With
+    speculative=True the rewrite and the raw-question retrieval are awaited
+    together with asyncio.gather instead of on the rewrite thread pool.
+    embed is an async (embedding, cost) function, default embed_query_async.
+    """
+    cost = 0.0
+    index = VectorIndex.from_index_data(index_data)
+    cache_key = index.cache_key  # answers are only cached if the index didn't change meanwhile
+    embed = embed or embed_query_async
+
+    start = time.time()
+    question_embedding = None
+    cached = _cache_lookup(answer_cache, question, index, cost, start)
+    if cached is None and _wants_question_embedding(answer_cache, question, index, top_k):
+        question_embedding, embed_cost = await embed(question)
+        cost += embed_cost
+        cached = _cache_lookup(answer_cache, question, index, cost, start, question_embedding)
+    if cached is not None:
+        return cached
+
+    vocabulary = index.lexical.vocabulary
+    retrieval_path = "direct"
+    if _speculates(speculative, question, vocabulary):
+        (rewritten_query, rewrite_cost, rewrite_time), (
+            chunks,
+            retrieval_cost,
+            retrieval_time,
+        ) = await asyncio.gather(
+            _timed_rewrite_async(question, vocabulary),
+            _timed_retrieval_async(question, index, top_k, question_embedding, embed),
+        )
+        cost += rewrite_cost + retrieval_cost
+        if _speculation_holds(question, rewritten_query, chunks, index, top_k):
+            retrieval_path = "speculative"
+        else:
+            retrieval_path = "rewritten"
+            chunks, retrieval_cost, extra_time = await _timed_retrieval_async(
+                rewritten_query, index, top_k, None, embed
+            )
+            retrieval_time += extra_time
+            cost += retrieval_cost
+    else:
+        rewritten_query, rewrite_cost, rewrite_time = await _timed_rewrite_async(
+            question, vocabulary
+        )
+        cost += rewrite_cost
+        chunks, retrieval_cost, retrieval_time = await _timed_retrieval_async(
+            rewritten_query,
+            index,
+            top_k,
+            _reusable_embedding(question, rewritten_query, question_embedding),
+            embed,
+        )
+        cost += retrieval_cost
+
+    retrieval_class = classify_retrieval(chunks)
+
+    generation_time = 0.0
+    generation_class = None
+    if retrieval_class["status"] == "failed":
+        answer = await handle_refusal_async(question, chunks)
+        generation_class = _refusal_generation_class(judge_refusals)
+    else:
+        start = time.time()
+        answer, llm_cost = await generate_answer_async(question, chunks)
+        generation_time = time.time() - start
+        cost += llm_cost
+
+    if classify and generation_class is None:
+        generation_class = await classify_generation_async(question, chunks, answer)
+
+    result = _result(
+        question,
+        rewritten_query,
+        chunks,
+        retrieval_class,
+        answer,
+        generation_class,
+        cost,
+        question_embedding=question_embedding,
+        retrieval_path=retrieval_path,
+        latency=(rewrite_time, retrieval_time, generation_time),
+    )
+    _store(answer_cache, question, index, cache_key, result)
+    return result
@@ -1,38 +1,135 @@
-from openai import OpenAI
-from dotenv import load_dotenv
+import threading
+from collections import OrderedDict
 
-load_dotenv()
-client = OpenAI()
+from clients import create_chat_completion, create_chat_completion_async, usage_cost
+from lexical_index import tokenize
 
-LLM_INPUT_COST_PER_TOKEN = 0.15 / 1_000_000
-LLM_OUTPUT_COST_PER_TOKEN = 0.60 / 1_000_000
+REWRITE_CACHE_SIZE = 2048  # memoized rewrites kept per process
 
+# Words that are fine in a question even if the corpus never uses them
+QUESTION_WORDS = frozenset(
+    """about also any between can could describe difference explain give i
+    list many me mean meaning much my name should summarize summary tell
+    there they we would you your""".split()
+)
 
-def rewrite_query(question):
-    """Use LLM to clean and expand the user's question before retrieval."""
+_rewrite_cache = OrderedDict()
+_rewrite_cache_lock = threading.Lock()
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": """You are a search query optimizer. Your job is to:
+
+def is_clean_query(question, vocabulary):
+    """True if every term of the question is a known word, so rewriting can be skipped.
+
+    vocabulary is any container of lowercase tokens, e.g. the terms of the
+    loaded corpus's BM25 index. Numbers always count as known.
+    """
+    terms = tokenize(question)
+    return bool(terms) and all(
+        term in vocabulary or term in QUESTION_WORDS or term.isdigit() for term in terms
+    )
+
+
+def needs_llm_rewrite(question, vocabulary=None):
+    """Whether rewrite_query would call the LLM (not memoized, not clean)."""
+    with _rewrite_cache_lock:
+        if " ".join(question.split()) in _rewrite_cache:
+            return False
+    return vocabulary is None or not is_clean_query(question, vocabulary)
+
+
+def _rewrite_without_llm(question, vocabulary):
+    """(memo key, rewrite) where rewrite is None if the LLM is needed."""
+    key = " ".join(question.split())
+    rewritten = _memoized(key)
+    if rewritten is None and vocabulary is not None and is_clean_query(question, vocabulary):
+        rewritten = key
+    return key, rewritten
+
+
+def _memoized(key):
+    with _rewrite_cache_lock:
+        if key in _rewrite_cache:
+            _rewrite_cache.move_to_end(key)
+            return _rewrite_cache[key]
+    return None
+
+
+def _memoize(key, rewritten):
+    with _rewrite_cache_lock:
+        _rewrite_cache[key] = rewritten
+        while len(_rewrite_cache) > REWRITE_CACHE_SIZE:
+            _rewrite_cache.popitem(last=False)
+
+
+def rewrite_query(question, vocabulary=None):
+    """Clean and expand the user's question before retrieval.
+
+    Questions seen before are answered from an in-process memo. If a
+    vocabulary is given and the question only uses known words, it is
+    returned unchanged; otherwise an LLM fixes typos and rephrases it.
+
+    Returns:
+        tuple: (rewritten, cost)
+    """
+    key, rewritten = _rewrite_without_llm(question, vocabulary)
+    if rewritten is not None:
+        return rewritten, 0.0
+
+    rewritten, cost = _rewrite_with_llm(question)
+    _memoize(key, rewritten)
+    return rewritten, cost
+
+
+async def rewrite_query_async(question, vocabulary=None):
+    """Async rewrite_query on the shared AsyncOpenAI client (same memo)."""
+    key, rewritten = _rewrite_without_llm(question, vocabulary)
+    if rewritten is not None:
+        return rewritten, 0.0
+
+    rewritten, cost = await _rewrite_with_llm_async(question)
+    _memoize(key, rewritten)
+    return rewritten, cost
+
+
+def _rewrite_messages(question):
+    return [
+        {
+            "role": "system",
+            "content": """You are a search query optimizer. Your job is to:
 1. Fix any spelling mistakes - if a word doesn't make sense, assume it's a typo and correct it to the closest real word
 2. For unclear proper nouns or brand names that look misspelled, make your best guess at the correct spelling
 3. Rephrase the question to be clearer for semantic search
 
 Return ONLY the rewritten query. Nothing else. No explanation.""",
-            },
-            {"role": "user", "content": f"Rewrite this search query: {question}"},
-        ],
+        },
+        {"role": "user", "content": f"Rewrite this search query: {question}"},
+    ]
+
+
+def _parse_rewrite(response):
+    rewritten = response.choices[0].message.content.strip()
+    return rewritten, usage_cost("gpt-4o-mini", response.usage)
+
+
+def _rewrite_with_llm(question):
+    """Use LLM to clean and expand the user's question before retrieval."""
+
+    response = create_chat_completion(
+        "rewrite",
+        model="gpt-4o-mini",
+        messages=_rewrite_messages(question),
         temperature=0,
         max_tokens=100,
     )
+    return _parse_rewrite(response)
 
-    cost = (
-        response.usage.prompt_tokens * LLM_INPUT_COST_PER_TOKEN
-        + response.usage.completion_tokens * LLM_OUTPUT_COST_PER_TOKEN
-    )
 
-    rewritten = response.choices[0].message.content.strip()
-    return rewritten, cost
+async def _rewrite_with_llm_async(question):
+    response = await create_chat_completion_async(
+        "rewrite",
+        model="gpt-4o-mini",
+        messages=_rewrite_messages(question),
+        temperature=0,
+        max_tokens=100,
+    )
+    return _parse_rewrite(response)
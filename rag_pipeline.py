@@ -1,24 +1,15 @@
-from openai import OpenAI
-from dotenv import load_dotenv
+import json
 
-load_dotenv()
-client = OpenAI()
+from clients import create_chat_completion, create_chat_completion_async, metrics, usage_cost
 
-# Pricing per token
-LLM_INPUT_COST_PER_TOKEN = 0.15 / 1_000_000  # gpt-4o-mini input
-LLM_OUTPUT_COST_PER_TOKEN = 0.60 / 1_000_000  # gpt-4o-mini output
 
-
-def generate_answer(question, retrieved_chunks):
-    """Generate an answer using retrieved context.
-
-    Returns:
-        tuple: (answer_text, cost)
-    """
+def _build_answer_messages(question, retrieved_chunks):
+    """Build the chat messages for answer generation."""
     # Build context from retrieved chunks
-    context = ""
-    for i, chunk in enumerate(retrieved_chunks, 1):
-        context += f"\n[Source {i}: {chunk['source']}]\n{chunk['text']}\n"
+    context = "".join(
+        f"\n[Source {i}: {chunk['source']}]\n{chunk['text']}\n"
+        for i, chunk in enumerate(retrieved_chunks, 1)
+    )
 
     system_prompt = """You are a helpful AI assistant that answers questions based ONLY on the provided context.
 
@@ -36,35 +27,94 @@ Question: {question}
 
 Answer the question using only the information above. Cite your sources."""
 
-    response = client.chat.completions.create(
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def generate_answer(question, retrieved_chunks):
+    """Generate an answer using retrieved context.
+
+    Returns:
+        tuple: (answer_text, cost)
+    """
+    response = create_chat_completion(
+        "generate",
         model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
+        messages=_build_answer_messages(question, retrieved_chunks),
         temperature=0,
         max_tokens=1024,
     )
 
-    cost = (
-        response.usage.prompt_tokens * LLM_INPUT_COST_PER_TOKEN
-        + response.usage.completion_tokens * LLM_OUTPUT_COST_PER_TOKEN
+    return response.choices[0].message.content, usage_cost("gpt-4o-mini", response.usage)
+
+
+async def generate_answer_async(question, retrieved_chunks):
+    """Async generate_answer on the shared AsyncOpenAI client."""
+    response = await create_chat_completion_async(
+        "generate",
+        model="gpt-4o-mini",
+        messages=_build_answer_messages(question, retrieved_chunks),
+        temperature=0,
+        max_tokens=1024,
     )
 
-    return response.choices[0].message.content, cost
+    return response.choices[0].message.content, usage_cost("gpt-4o-mini", response.usage)
 
 
-def classify_generation(question, retrieved_chunks, answer):
-    """Use LLM-as-a-judge to classify generation quality."""
+class AnswerStream:
+    """Iterable of answer text deltas from a streaming completion.
 
-    context_preview = "\n".join([c["text"][:200] for c in retrieved_chunks])
+    Once fully consumed, `text` holds the complete answer and `cost` the
+    price taken from the final usage chunk.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._parts = []
+        self.cost = 0.0
+
+    def __iter__(self):
+        for event in self._response:
+            if event.usage is not None:
+                self.cost = usage_cost("gpt-4o-mini", event.usage)
+                metrics.add_usage("generate_stream", "gpt-4o-mini", event.usage)
+            if event.choices and event.choices[0].delta.content:
+                delta = event.choices[0].delta.content
+                self._parts.append(delta)
+                yield delta
 
-    response = client.chat.completions.create(
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+
+def generate_answer_stream(question, retrieved_chunks):
+    """Streaming variant of generate_answer.
+
+    Returns:
+        AnswerStream: iterate it (e.g. with st.write_stream) to get deltas
+    """
+    response = create_chat_completion(
+        "generate_stream",
         model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": """You are an answer quality classifier. Given a question, the context provided to an AI, and the AI's answer, classify the answer as one of:
+        messages=_build_answer_messages(question, retrieved_chunks),
+        temperature=0,
+        max_tokens=1024,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    return AnswerStream(response)
+
+
+def _classification_messages(question, retrieved_chunks, answer):
+    context_preview = "\n".join([c["text"][:200] for c in retrieved_chunks])
+
+    return [
+        {
+            "role": "system",
+            "content": """You are an answer quality classifier. Given a question, the context provided to an AI, and the AI's answer, classify the answer as one of:
 
 - "refused": the AI said it doesn't have information, cannot answer, or the context doesn't contain relevant info
 - "hedged": the AI gave a partial answer but expressed uncertainty or said information was limited
@@ -72,18 +122,15 @@ def classify_generation(question, retrieved_chunks, answer):
 
 Reply with ONLY a JSON object like this:
 {"status": "refused", "reason": "brief explanation"}""",
-            },
-            {
-                "role": "user",
-                "content": f"Question: {question}\n\nContext given to AI:\n{context_preview}\n\nAI Answer: {answer}",
-            },
-        ],
-        temperature=0,
-        max_tokens=100,
-    )
+        },
+        {
+            "role": "user",
+            "content": f"Question: {question}\n\nContext given to AI:\n{context_preview}\n\nAI Answer: {answer}",
+        },
+    ]
 
-    import json
 
+def _parse_classification(response):
     try:
         raw = response.choices[0].message.content.strip()
         if not raw:
@@ -94,29 +141,70 @@ Reply with ONLY a JSON object like this:
         return {"status": "unknown", "reason": f"classifier failed: {str(e)}"}
 
 
-def handle_refusal(question, retrieved_chunks):
-    """Generate a helpful redirect when retrieval fails."""
+def classify_generation(question, retrieved_chunks, answer):
+    """Use LLM-as-a-judge to classify generation quality."""
+    response = create_chat_completion(
+        "classify",
+        model="gpt-4o-mini",
+        messages=_classification_messages(question, retrieved_chunks, answer),
+        temperature=0,
+        max_tokens=100,
+    )
+    return _parse_classification(response)
 
-    context_preview = "\n".join([c["text"][:300] for c in retrieved_chunks])
 
-    response = client.chat.completions.create(
+async def classify_generation_async(question, retrieved_chunks, answer):
+    """Async classify_generation on the shared AsyncOpenAI client."""
+    response = await create_chat_completion_async(
+        "classify",
         model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": """You are a helpful assistant. The user asked a question that cannot be answered from the available sources. 
+        messages=_classification_messages(question, retrieved_chunks, answer),
+        temperature=0,
+        max_tokens=100,
+    )
+    return _parse_classification(response)
+
+
+def _refusal_messages(question, retrieved_chunks):
+    context_preview = "\n".join([c["text"][:300] for c in retrieved_chunks])
+
+    return [
+        {
+            "role": "system",
+            "content": """You are a helpful assistant. The user asked a question that cannot be answered from the available sources. 
 Your job is to:
 1. Politely tell them their question can't be answered from the loaded sources
 2. In one sentence, describe what the sources actually seem to be about
 3. Suggest a more relevant question they could ask
 
 Keep it short, friendly, and helpful.""",
-            },
-            {
-                "role": "user",
-                "content": f"User question: {question}\n\nAvailable context:\n{context_preview}",
-            },
-        ],
+        },
+        {
+            "role": "user",
+            "content": f"User question: {question}\n\nAvailable context:\n{context_preview}",
+        },
+    ]
+
+
+def handle_refusal(question, retrieved_chunks):
+    """Generate a helpful redirect when retrieval fails."""
+    response = create_chat_completion(
+        "refusal",
+        model="gpt-4o-mini",
+        messages=_refusal_messages(question, retrieved_chunks),
+        temperature=0.3,
+        max_tokens=150,
+    )
+
+    return response.choices[0].message.content.strip()
+
+
+async def handle_refusal_async(question, retrieved_chunks):
+    """Async handle_refusal on the shared AsyncOpenAI client."""
+    response = await create_chat_completion_async(
+        "refusal",
+        model="gpt-4o-mini",
+        messages=_refusal_messages(question, retrieved_chunks),
         temperature=0.3,
         max_tokens=150,
     )
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """Thread-safe token bucket refilled continuously at rate_per_minute.
+
+    The bucket holds at most one minute's worth of capacity, so short bursts
+    are allowed but sustained throughput never exceeds the configured rate.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self._available = self.capacity
+        self._refill_per_second = self.capacity / 60.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._available = min(
+            self.capacity, self._available + elapsed * self._refill_per_second
+        )
+        self._updated = now
+
+    def _try_take(self, amount):
+        """Take `amount` units and return 0, or return the seconds to wait."""
+        with self._lock:
+            self._refill()
+            if self._available >= amount:
+                self._available -= amount
+                return 0.0
+            return (amount - self._available) / self._refill_per_second
+
+    def acquire(self, amount=1):
+        """Block until `amount` units are available, then take them."""
+        # A single request larger than the bucket waits for a full bucket
+        amount = min(float(amount), self.capacity)
+        while True:
+            wait = self._try_take(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        """acquire() for coroutines: waits with asyncio.sleep, not blocking the loop."""
+        amount = min(float(amount), self.capacity)
+        while True:
+            wait = self._try_take(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
@@ -1,12 +1,14 @@
 import numpy as np
-from openai import OpenAI
-from dotenv import load_dotenv
 
-load_dotenv()
-client = OpenAI()
+from clients import create_embedding, create_embedding_async, usage_cost
+from lexical_index import tokenize
+from vector_index import VectorIndex
 
-# Pricing per token
-EMBED_COST_PER_TOKEN = 0.02 / 1_000_000  # text-embedding-3-small
+# Lexical fast path: answer from BM25 alone (no query embedding) when the
+# best chunk contains every query term and clearly outscores the runner-up
+FAST_PATH_MIN_TERMS = 2
+FAST_PATH_MARGIN = 1.5
+RETRIEVAL_MODES = ("hybrid", "dense")
 
 
 def cosine_similarity(vec1, vec2):
@@ -24,37 +26,147 @@ def cosine_similarity(vec1, vec2):
     return dot_product / (magnitude1 * magnitude2)
 
 
-def retrieve_relevant_chunks(question, index_data, top_k=5):
+def embed_query(question):
+    """Embed a single query string.
+
+    Returns:
+        tuple: (embedding, cost)
+    """
+    response = create_embedding("query_embed", input=question, model="text-embedding-3-small")
+    return response.data[0].embedding, usage_cost("text-embedding-3-small", response.usage)
+
+
+async def embed_query_async(question):
+    """Async embed_query on the shared AsyncOpenAI client."""
+    response = await create_embedding_async(
+        "query_embed", input=question, model="text-embedding-3-small"
+    )
+    return response.data[0].embedding, usage_cost("text-embedding-3-small", response.usage)
+
+
+def lexical_fast_path(question, index, top_k=5):
+    """Return BM25-only results if the question is a strong keyword match, else None.
+
+    No embedding is computed, so fast-path chunks have no cosine score:
+    "similarity" is None and they carry their query-term "coverage" and
+    BM25 "score" instead (see classify_retrieval).
+    """
+    if len(set(tokenize(question))) < FAST_PATH_MIN_TERMS:
+        return None
+    hits = index.lexical_search(question, top_k=max(top_k, 2))
+    if not hits or hits[0]["coverage"] < 1.0:
+        return None
+    if len(hits) > 1 and hits[0]["bm25"] < FAST_PATH_MARGIN * hits[1]["bm25"]:
+        return None
+    return [
+        {
+            "text": hit["text"],
+            "source": hit["source"],
+            "similarity": None,
+            "coverage": hit["coverage"],
+            "score": hit["bm25"],
+            "retrieval": "lexical",
+        }
+        for hit in hits[:top_k]
+    ]
+
+
+def retrieve_relevant_chunks(
+    question,
+    index_data,
+    top_k=5,
+    mode="hybrid",
+    fast_path=True,
+    query_embedding=None,
+    embed=None,
+):
     """Find the most relevant chunks for a given question.
 
+    index_data may be a VectorIndex or the legacy list of chunk dicts.
+    mode="hybrid" fuses dense and BM25 rankings; mode="dense" is cosine
+    only. With fast_path=True a strong keyword match is answered from the
+    BM25 index without embedding the question. Pass query_embedding if the
+    question has already been embedded to skip that call. embed replaces
+    embed_query (e.g. with a batching embedder) and returns (embedding, cost).
+
     Returns:
         tuple: (top_chunks, cost) where cost is the embedding API cost
     """
-    # Convert question to embedding
-    response = client.embeddings.create(input=question, model="text-embedding-3-small")
-    question_embedding = response.data[0].embedding
-    cost = response.usage.total_tokens * EMBED_COST_PER_TOKEN
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    index = VectorIndex.from_index_data(index_data)
 
-    # Calculate similarity with all chunks
-    similarities = []
-    for item in index_data:
-        similarity = cosine_similarity(question_embedding, item["embedding"])
-        similarities.append(
-            {"text": item["text"], "source": item["source"], "similarity": similarity}
-        )
+    if fast_path:
+        top_chunks = lexical_fast_path(question, index, top_k=top_k)
+        if top_chunks:
+            return top_chunks, 0.0
 
-    # Sort by similarity and get top K
-    similarities.sort(key=lambda x: x["similarity"], reverse=True)
-    top_chunks = similarities[:top_k]
+    if query_embedding is None:
+        question_embedding, cost = (embed or embed_query)(question)
+    else:
+        question_embedding, cost = query_embedding, 0.0
+    return _search(index, question, question_embedding, top_k, mode), cost
+
+
+async def retrieve_relevant_chunks_async(
+    question,
+    index_data,
+    top_k=5,
+    mode="hybrid",
+    fast_path=True,
+    query_embedding=None,
+    embed=None,
+):
+    """Async retrieve_relevant_chunks; embed is an async (embedding, cost) function.
+
+    Only the query embedding is awaited; the in-memory search runs inline.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    index = VectorIndex.from_index_data(index_data)
+
+    if fast_path:
+        top_chunks = lexical_fast_path(question, index, top_k=top_k)
+        if top_chunks:
+            return top_chunks, 0.0
+
+    if query_embedding is None:
+        question_embedding, cost = await (embed or embed_query_async)(question)
+    else:
+        question_embedding, cost = query_embedding, 0.0
+    return _search(index, question, question_embedding, top_k, mode), cost
+
+
+def _search(index, question, question_embedding, top_k, mode):
+    if mode == "hybrid":
+        return index.hybrid_search(question_embedding, question, top_k=top_k)
+    return index.search(question_embedding, top_k=top_k)
 
-    return top_chunks, cost
+
+def score_label(chunk):
+    """Short display string for a retrieved chunk's relevance."""
+    if chunk.get("similarity") is None:
+        return f"keywords {chunk.get('coverage', 0.0):.0%}"
+    return f"{chunk['similarity']:.3f}"
 
 
 def classify_retrieval(top_chunks):
     if not top_chunks:
         return {"status": "failed", "reason": "no chunks retrieved", "top_score": 0.0}
 
-    top_score = top_chunks[0]["similarity"]
+    # Lexical fast-path results have no cosine score to threshold. Every
+    # query term matched, so this isn't a miss, but it isn't semantic
+    # evidence either: never "confident"
+    if any(chunk.get("similarity") is None for chunk in top_chunks):
+        return {
+            "status": "uncertain",
+            "reason": "keyword match only - no similarity score",
+            "top_score": None,
+            "top_coverage": round(max(c.get("coverage", 0.0) for c in top_chunks), 4),
+        }
+
+    # Hybrid results are ordered by fused rank, not by similarity
+    top_score = max(chunk["similarity"] for chunk in top_chunks)
 
     if top_score >= 0.7:
         return {
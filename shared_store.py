@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from quantization import QuantizedMatrix, empty_storage
+
+MAX_IDLE_ROWS = 50_000  # unreferenced rows kept for reuse before eviction
+
+
+class SharedEmbeddingStore:
+    """Process-wide, content-addressed embedding rows shared by every session.
+
+    Rows are keyed by chunk content hash (see vector_index.content_hash), so
+    two sessions that load the same document hold one copy of its vectors
+    and only the first pays to embed it. Each VectorIndex built on the store
+    keeps a StoreLease with references to its rows; rows nobody references
+    stay around (LRU) up to max_idle_rows for the next session, then their
+    slots are reused.
+    """
+
+    def __init__(self, dim, storage="int8", max_idle_rows=MAX_IDLE_ROWS):
+        self.dim = dim
+        self.storage = storage
+        self.max_idle_rows = max_idle_rows
+        self._lock = threading.Lock()
+        self._matrix = empty_storage(storage, 0, dim)
+        self._size = 0
+        self._rows = {}  # content hash -> row
+        self._hashes = {}  # row -> content hash
+        self._texts = {}  # row -> chunk text
+        self._refs = {}  # row -> number of leases holding it
+        self._idle = OrderedDict()  # unreferenced rows, least recently used first
+        self._free = []
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rows)
+
+    def contains(self, content_hash):
+        with self._lock:
+            return content_hash in self._rows
+
+    def _retain(self, row):
+        self._refs[row] = self._refs.get(row, 0) + 1
+        self._idle.pop(row, None)
+
+    def acquire(self, hashes):
+        """Take a reference on the rows for hashes; -1 where a hash is absent."""
+        rows = []
+        with self._lock:
+            for h in hashes:
+                row = self._rows.get(h, -1)
+                if row >= 0:
+                    self._retain(row)
+                rows.append(row)
+        return np.array(rows, dtype=np.int64)
+
+    def add(self, hashes, vectors, texts):
+        """Store unit vectors (or reuse existing rows) and take a reference on each."""
+        rows = []
+        with self._lock:
+            for h, vector, text in zip(hashes, vectors, texts):
+                row = self._rows.get(h)
+                if row is None:
+                    row = self._allocate()
+                    self._matrix[row : row + 1] = vector[None, :]
+                    self._rows[h] = row
+                    self._hashes[row] = h
+                    self._texts[row] = text
+                self._retain(row)
+                rows.append(row)
+        return np.array(rows, dtype=np.int64)
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        if self._size == len(self._matrix):
+            capacity = max(64, 2 * self._size)
+            # Readers keep using the old array; their rows are copied unchanged
+            if isinstance(self._matrix, QuantizedMatrix):
+                self._matrix = self._matrix.resized(capacity, self._size)
+            else:
+                grown = empty_storage(self.storage, capacity, self.dim)
+                grown[: self._size] = self._matrix[: self._size]
+                self._matrix = grown
+        self._size += 1
+        return self._size - 1
+
+    def release(self, rows):
+        """Drop one reference per row; idle rows past the limit are evicted."""
+        with self._lock:
+            for row in np.asarray(rows).tolist():
+                if row < 0 or row not in self._refs:
+                    continue
+                self._refs[row] -= 1
+                if self._refs[row] == 0:
+                    del self._refs[row]
+                    self._idle[row] = None
+            while len(self._idle) > self.max_idle_rows:
+                row, _ = self._idle.popitem(last=False)
+                del self._rows[self._hashes.pop(row)]
+                del self._texts[row]
+                self._free.append(row)
+
+    def text(self, row):
+        return self._texts[row]
+
+    def vectors(self, rows):
+        """float32 rows (dequantized if the store is quantized)."""
+        return np.asarray(self._matrix[np.asarray(rows)], dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        return int(self._matrix.nbytes / max(len(self._matrix), 1) * self._size)
+
+
+class StoreLease:
+    """The store rows one VectorIndex references, released when it is collected."""
+
+    def __init__(self, store):
+        self.store = store
+        self.rows = np.empty(0, dtype=np.int64)
+
+    def release(self):
+        self.store.release(self.rows)
+        self.rows = np.empty(0, dtype=np.int64)
+
+
+class SharedRows:
+    """Read-only matrix-like view of an index's rows inside a shared store."""
+
+    def __init__(self, store, rows):
+        self.store = store
+        self.rows = rows
+        self.shape = (len(rows), store.dim)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, key):
+        return self.store.vectors(self.rows[key])
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_shared_store(dim, storage="int8"):
+    """Return the process-wide store for a dimension and storage mode."""
+    with _stores_lock:
+        key = (dim, storage)
+        if key not in _stores:
+            _stores[key] = SharedEmbeddingStore(dim, storage)
+        return _stores[key]
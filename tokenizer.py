@@ -0,0 +1,37 @@
+try:
+    import tiktoken
+except ImportError:  # fall back to a ~4 characters/token approximation
+    tiktoken = None
+
+ENCODING_NAME = "cl100k_base"  # used by text-embedding-3-small and gpt-4o-mini
+CHARS_PER_TOKEN = 4  # fallback estimate when tiktoken is unavailable
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+def encode(text):
+    """Split text into tokens (token ids, or fixed-size slices in fallback mode)."""
+    if tiktoken is None:
+        return [text[i : i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+    return _get_encoding().encode(text, disallowed_special=())
+
+
+def decode(tokens):
+    """Inverse of encode."""
+    if tiktoken is None:
+        return "".join(tokens)
+    return _get_encoding().decode(tokens)
+
+
+def count_tokens(text):
+    """Number of tokens the embedding model will bill for text."""
+    if tiktoken is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(_get_encoding().encode(text, disallowed_special=()))
@@ -0,0 +1,579 @@
+import hashlib
+import json
+import os
+import uuid
+import weakref
+
+import numpy as np
+
+from ann_index import DEFAULT_NPROBE, IVFIndex
+from lexical_index import BM25Index
+from shared_store import SharedRows, StoreLease
+from quantization import STORAGE_MODES, QuantizedMatrix, empty_storage
+
+EMBEDDING_DIM = 1536  # text-embedding-3-small
+
+# On-disk layout: a directory holding the raw embedding matrix and a
+# JSON sidecar with the shape, dtype and per-chunk metadata.
+EMBEDDINGS_FILE = "embeddings.bin"
+META_FILE = "meta.json"
+ANN_FILE = "ann.npz"
+FORMAT_VERSION = 1
+STORAGE_DTYPES = ("float32", "float16")
+SCORE_BLOCK_ROWS = 16384  # rows upcast at a time when scoring float16 matrices
+COMPACT_DEAD_FRACTION = 0.25  # rebuild once this share of rows is tombstoned
+RRF_K = 60  # reciprocal rank fusion damping; 60 is the usual default
+HYBRID_CANDIDATES = 4  # each ranker contributes top_k * this candidates to fusion
+ANN_MIN_ROWS = 20_000  # build an IVF index automatically past this many rows
+ANN_RETRAIN_GROWTH = 4  # retrain IVF centroids once the index grows this much
+
+
+def content_hash(text):
+    """Stable hash of a chunk's text (whitespace-normalized)."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def normalize_rows(matrix):
+    """Scale each row to unit length (zero rows are left as zeros)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """In-memory index holding every chunk embedding in one normalized matrix.
+
+    Rows are unit length, so cosine similarity against a query is a single
+    matrix-vector product. Chunk metadata (text, source, chunk_id, content
+    hash) is kept in a parallel list with the same row order, and a BM25
+    inverted index over the same rows backs lexical and hybrid search.
+    Past ANN_MIN_ROWS rows dense search goes through an IVF index (see
+    ann_index.py) instead of scoring every row.
+
+    storage picks the in-memory representation of the rows (see
+    quantization.py): float32, float16, or int8 with a per-row scale. With
+    a store (a SharedEmbeddingStore) the vectors live there instead, shared
+    with every other index that holds the same chunks; this index keeps
+    only row references, released when it is garbage collected.
+
+    Removed rows are tombstoned and skipped by search; the matrix is
+    compacted once enough of them pile up. `version` changes on every
+    mutation so caches keyed on it invalidate automatically.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, storage="float32", store=None):
+        if store is not None:
+            storage = store.storage
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unsupported storage mode: {storage}")
+        self.dim = dim
+        self.storage = storage
+        self.uid = uuid.uuid4().hex
+        self.chunks = []
+        self.total_tokens = 0
+        self.version = 0
+        self.source_versions = {}
+        self.build_params = {}  # how the chunks were made; saved so stale indexes can be spotted
+        self._lease = None
+        if store is not None:
+            self._lease = StoreLease(store)
+            weakref.finalize(self, self._lease.release)
+            self._matrix = None
+        else:
+            self._matrix = empty_storage(storage, 0, dim)
+        self._alive = np.empty(0, dtype=bool)
+        self._size = 0
+        self._dead = 0
+        self._lexical = BM25Index()  # None means "rebuild on first use"
+        self.ann = None
+
+    @classmethod
+    def from_index_data(cls, index_data):
+        """Build an index from the legacy list-of-dicts format."""
+        if isinstance(index_data, cls):
+            return index_data
+        dim = len(index_data[0]["embedding"]) if index_data else EMBEDDING_DIM
+        index = cls(dim=dim)
+        index.add(index_data, [item["embedding"] for item in index_data])
+        return index
+
+    def __len__(self):
+        return self._size - self._dead
+
+    @property
+    def cache_key(self):
+        """Identifies this index's current contents, for caches of query results."""
+        return (self.uid, self.version)
+
+    @property
+    def matrix(self):
+        """The (size x dim) embedding matrix, including tombstoned rows.
+
+        Quantized or shared storage is returned as a QuantizedMatrix or
+        SharedRows, whose slices come back as float32 on access.
+        """
+        if self._lease is not None:
+            return SharedRows(self._lease.store, self._lease.rows[: self._size])
+        if isinstance(self._matrix, QuantizedMatrix):
+            return self._matrix.head(self._size)
+        return self._matrix[: self._size]
+
+    @property
+    def nbytes(self):
+        """Memory held by the stored embeddings (excluding spare capacity).
+
+        For a shared index only the row references count.
+        """
+        if self._lease is not None:
+            return self._lease.rows[: self._size].nbytes
+        per_row = self._matrix.nbytes / max(len(self._matrix), 1)
+        return int(per_row * self._size)
+
+    def add(self, chunks, embeddings):
+        """Append chunks and their embeddings to the index."""
+        if len(chunks) != len(embeddings):
+            raise ValueError("chunks and embeddings must have the same length")
+        if not chunks:
+            return
+
+        vectors = normalize_rows(embeddings)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}"
+            )
+        for chunk in chunks:
+            chunk.setdefault("hash", content_hash(chunk["text"]))
+
+        store_rows = None
+        if self._lease is not None:
+            store_rows = self._lease.store.add(
+                [chunk["hash"] for chunk in chunks], vectors, [chunk["text"] for chunk in chunks]
+            )
+        self._append(chunks, vectors, store_rows)
+
+    def shares(self, content_hash):
+        """Whether a chunk with this hash could be added without embedding it."""
+        return self._lease is not None and self._lease.store.contains(content_hash)
+
+    def add_shared(self, chunks):
+        """Append chunks whose vectors are already in the shared store.
+
+        Returns the chunks that aren't there (they still need embedding).
+        """
+        if self._lease is None or not chunks:
+            return list(chunks)
+        for chunk in chunks:
+            chunk.setdefault("hash", content_hash(chunk["text"]))
+        rows = self._lease.store.acquire([chunk["hash"] for chunk in chunks])
+        found = rows >= 0
+        self._append(
+            [chunk for chunk, ok in zip(chunks, found) if ok],
+            self._lease.store.vectors(rows[found]),
+            rows[found],
+        )
+        return [chunk for chunk, ok in zip(chunks, found) if not ok]
+
+    def _append(self, chunks, vectors, store_rows=None):
+        if not chunks:
+            return
+        self._reserve(self._size + len(vectors))
+        start = self._size
+        if store_rows is not None:
+            self._lease.rows[start : start + len(vectors)] = store_rows
+        else:
+            self._matrix[start : start + len(vectors)] = vectors
+        self._alive[start : start + len(vectors)] = True
+        self._size += len(vectors)
+        self.version += 1
+
+        # New rows go into the nearest existing IVF buckets until the index
+        # has outgrown its centroids, then they are retrained
+        if self.ann is not None and self._size <= ANN_RETRAIN_GROWTH * self.ann.trained_rows:
+            self.ann.add(vectors, start_row=start)
+        elif self.ann is not None or self._size >= ANN_MIN_ROWS:
+            self.build_ann(nprobe=self.ann.nprobe if self.ann else DEFAULT_NPROBE)
+
+        for i, chunk in enumerate(chunks):
+            # Shared stores hand back one canonical copy of each text
+            text = chunk["text"] if store_rows is None else self._lease.store.text(store_rows[i])
+            if self._lexical is not None:
+                self._lexical.add(len(self.chunks), text)
+            self.chunks.append(
+                {
+                    "text": text,
+                    "source": chunk["source"],
+                    "chunk_id": chunk.get("chunk_id"),
+                    "tokens": chunk.get("tokens", 0),
+                    "hash": chunk["hash"],
+                    # Shared with the deduplicator, so later duplicates' sources show up here
+                    "sources": chunk.get("sources", [chunk["source"]]),
+                }
+            )
+            self.total_tokens += chunk.get("tokens", 0)
+
+    def _reserve(self, capacity):
+        """Grow the backing matrix geometrically so appends stay amortized O(1)."""
+        current = len(self._alive)
+        if capacity <= current:
+            return
+        new_capacity = max(capacity, 2 * current, 64)
+        if self._lease is not None:
+            rows = np.full(new_capacity, -1, dtype=np.int64)
+            rows[: self._size] = self._lease.rows[: self._size]
+            self._lease.rows = rows
+        elif isinstance(self._matrix, QuantizedMatrix):
+            self._matrix = self._matrix.resized(new_capacity, self._size)
+        else:
+            grown = np.empty((new_capacity, self.dim), dtype=self._matrix.dtype)
+            grown[: self._size] = self._matrix[: self._size]
+            self._matrix = grown
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[: self._size] = self._alive[: self._size]
+        self._alive = alive
+
+    def remove(self, rows):
+        """Tombstone rows so search skips them."""
+        rows = [row for row in rows if self._alive[row]]
+        if not rows:
+            return
+        self._alive[rows] = False
+        self._dead += len(rows)
+        if self._lexical is not None:
+            for row in rows:
+                self._lexical.remove(row, self.chunks[row]["text"])
+        self.total_tokens -= sum(self.chunks[row].get("tokens", 0) for row in rows)
+        self.version += 1
+        if self._dead > COMPACT_DEAD_FRACTION * self._size:
+            self.compact()
+
+    def compact(self):
+        """Drop tombstoned rows from the matrix and metadata."""
+        keep = np.flatnonzero(self._alive[: self._size])
+        if self.ann is not None:
+            ann = IVFIndex(self.ann.centroids, nprobe=self.ann.nprobe)
+            ann.assign(self.ann.assignments()[keep])
+            ann.trained_rows = self.ann.trained_rows
+            self.ann = ann
+        if self._lease is not None:
+            dead = np.flatnonzero(~self._alive[: self._size])
+            self._lease.store.release(self._lease.rows[dead])
+            self._lease.rows = self._lease.rows[keep]
+        elif isinstance(self._matrix, QuantizedMatrix):
+            self._matrix = self._matrix.take(keep)
+        else:
+            self._matrix = np.ascontiguousarray(self._matrix[keep])
+        self.chunks = [self.chunks[row] for row in keep]
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._size = len(keep)
+        self._dead = 0
+        self._lexical = None  # row numbers changed
+
+    @property
+    def lexical(self):
+        """BM25 index over the live rows.
+
+        Built on first use after a load or compaction rather than up front,
+        so opening a saved index doesn't re-tokenize every chunk.
+        """
+        if self._lexical is None:
+            lexical = BM25Index()
+            for row, chunk in enumerate(self.chunks):
+                if self._alive[row]:
+                    lexical.add(row, chunk["text"])
+            self._lexical = lexical
+        return self._lexical
+
+    def source_rows(self, source):
+        """Map content hash -> row for the live chunks that came from a source.
+
+        Includes chunks first stored for another source that this source
+        duplicated (it is listed in their "sources").
+        """
+        return {
+            chunk["hash"]: row
+            for row, chunk in enumerate(self.chunks)
+            if self._alive[row] and source in chunk.get("sources", [chunk["source"]])
+        }
+
+    def retire_source_rows(self, source, keep_hashes):
+        """Drop a source's chunks whose hash is not in keep_hashes.
+
+        A chunk that other sources also contain just loses this source from
+        its "sources"; one that no source claims any more is tombstoned.
+        Bumps the source's version and returns the number of rows removed.
+        """
+        stale = []
+        for h, row in self.source_rows(source).items():
+            if h in keep_hashes:
+                continue
+            chunk = self.chunks[row]
+            sources = chunk.setdefault("sources", [chunk["source"]])
+            # Mutated in place: the deduplicator shares this list
+            sources.remove(source)
+            if sources:
+                chunk["source"] = sources[0]
+            else:
+                stale.append(row)
+        self.remove(stale)
+        self.source_versions[source] = self.source_versions.get(source, 0) + 1
+        return len(stale)
+
+    def update_source(self, source, chunks, embed):
+        """Re-ingest a source, embedding only chunks whose content changed.
+
+        chunks is the full new chunk list for the source. embed(chunks) must
+        return (embeddings, cost). Unchanged chunks keep their rows, new or
+        edited ones are embedded and appended, and chunks that disappeared
+        are tombstoned.
+
+        Returns:
+            dict: added, removed, unchanged, version and cost
+        """
+        existing = self.source_rows(source)
+        seen = set()
+        to_embed = []
+        for chunk in chunks:
+            h = chunk.setdefault("hash", content_hash(chunk["text"]))
+            if h in seen:
+                continue
+            seen.add(h)
+            if h not in existing:
+                to_embed.append(chunk)
+
+        embeddings, cost = embed(to_embed) if to_embed else ([], 0.0)
+        removed = self.retire_source_rows(source, seen)
+        self.add(to_embed, embeddings)
+
+        return {
+            "added": len(to_embed),
+            "removed": removed,
+            "unchanged": len(seen) - len(to_embed),
+            "version": self.source_versions[source],
+            "cost": cost,
+        }
+
+    def scores(self, query_embedding):
+        """Cosine similarity of the query against every row."""
+        query = normalize_rows(query_embedding)
+        matrix = self.matrix
+        if isinstance(matrix, QuantizedMatrix):
+            # Scale after the dot product: (codes @ q) * scale == (codes * scale) @ q
+            scores = np.empty(len(matrix), dtype=np.float32)
+            for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+                codes = matrix.codes[start : start + SCORE_BLOCK_ROWS]
+                scales = matrix.scales[start : start + SCORE_BLOCK_ROWS]
+                scores[start : start + len(codes)] = (codes.astype(np.float32) @ query) * scales
+            return scores
+        if isinstance(matrix, np.ndarray) and matrix.dtype == np.float32:
+            return matrix @ query
+
+        # Reduced-precision or shared storage: upcast block by block so we
+        # never hold a full float32 copy of a memory-mapped matrix
+        scores = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+            block = matrix[start : start + SCORE_BLOCK_ROWS]
+            scores[start : start + len(block)] = np.asarray(block, dtype=np.float32) @ query
+        return scores
+
+    def build_ann(self, nlist=None, nprobe=DEFAULT_NPROBE):
+        """(Re)build the IVF index over every row; nlist defaults to ~4 * sqrt(rows)."""
+        self.ann = IVFIndex.build(self.matrix, nlist=nlist, nprobe=nprobe) if self._size else None
+
+    def _score_rows(self, rows, query):
+        """Cosine similarity of a unit query against the given rows only."""
+        return np.asarray(self.matrix[rows], dtype=np.float32) @ query
+
+    def _dense_top(self, query_embedding, k, nprobe=None, exact=False):
+        """(rows, scores) of the k best live rows, best first.
+
+        Uses the IVF index when there is one, unless exact=True.
+        """
+        if exact or self.ann is None:
+            scores = self._live_scores(query_embedding)
+            top = self._top_rows(scores, min(k, len(self)))
+            return top, scores[top]
+
+        query = normalize_rows(query_embedding)
+        rows = self.ann.candidates(query, nprobe)
+        if self._dead:
+            rows = rows[self._alive[rows]]
+        scores = self._score_rows(rows, query)
+        top = self._top_rows(scores, min(k, len(rows)))
+        return rows[top], scores[top]
+
+    def _live_scores(self, query_embedding):
+        scores = self.scores(query_embedding)
+        if self._dead:
+            scores[~self._alive[: self._size]] = -np.inf
+        return scores
+
+    def _top_rows(self, scores, k):
+        """Rows of the k highest scores, best first."""
+        # Partial selection of the k best, then order just those k
+        if k < len(scores):
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(scores[top])[::-1]]
+
+    def _result(self, row, **scores):
+        chunk = self.chunks[row]
+        return {"text": chunk["text"], "source": chunk["source"], **scores}
+
+    def search(self, query_embedding, top_k=5, nprobe=None, exact=False):
+        """Return the top_k chunks as {"text", "source", "similarity"} dicts.
+
+        nprobe overrides the IVF index's default; exact=True scores every row.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        rows, scores = self._dense_top(query_embedding, top_k, nprobe, exact)
+        return [
+            self._result(int(row), similarity=float(score))
+            for row, score in zip(rows, scores)
+        ]
+
+    def lexical_search(self, query_text, top_k=5):
+        """BM25 top_k as {"text", "source", "bm25", "coverage"} dicts.
+
+        coverage is the fraction of distinct query terms the chunk contains.
+        """
+        if top_k <= 0:
+            return []
+        rows, bm25, coverage = self.lexical.top(query_text, top_k)
+        return [
+            self._result(int(row), bm25=float(score), coverage=float(cov))
+            for row, score, cov in zip(rows, bm25, coverage)
+        ]
+
+    def hybrid_search(
+        self, query_embedding, query_text, top_k=5, rrf_k=RRF_K, nprobe=None, exact=False
+    ):
+        """Fuse dense and BM25 rankings with reciprocal rank fusion.
+
+        Each ranker nominates its top_k * HYBRID_CANDIDATES rows; a row scores
+        sum(1 / (rrf_k + rank)) over the rankings it appears in. Results are
+        ordered by that fused score and still carry the dense cosine as
+        "similarity", so retrieval classification is unchanged.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+
+        candidates = top_k * HYBRID_CANDIDATES
+        dense_rows, dense_scores = self._dense_top(
+            query_embedding, candidates, nprobe, exact
+        )
+        lexical_rows, _, _ = self.lexical.top(query_text, candidates)
+
+        similarity = dict(zip(dense_rows.tolist(), dense_scores.tolist()))
+        lexical_only = [int(row) for row in lexical_rows if int(row) not in similarity]
+        if lexical_only:
+            scores = self._score_rows(lexical_only, normalize_rows(query_embedding))
+            similarity.update(zip(lexical_only, scores.tolist()))
+
+        fused = {}
+        for ranking in (dense_rows, lexical_rows):
+            for rank, row in enumerate(ranking):
+                fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (rrf_k + rank + 1)
+
+        best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        return [
+            self._result(row, similarity=float(similarity[row]), score=fused[row])
+            for row in best
+        ]
+
+    def save(self, path, dtype="float32"):
+        """Write the index to a directory as a raw matrix plus JSON sidecar.
+
+        Quantized (int8) indexes are written dequantized as dtype.
+        """
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage dtype: {dtype}")
+        os.makedirs(path, exist_ok=True)
+
+        # Only live rows are written; tombstones don't survive a save
+        keep = np.flatnonzero(self._alive[: self._size])
+
+        # Write to temp files and rename so readers never see a torn index
+        emb_path = os.path.join(path, EMBEDDINGS_FILE)
+        with open(emb_path + ".tmp", "wb") as f:
+            for start in range(0, len(keep), SCORE_BLOCK_ROWS):
+                block = self.matrix[keep[start : start + SCORE_BLOCK_ROWS]]
+                f.write(np.asarray(block).astype(dtype).tobytes())
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "dim": self.dim,
+            "count": len(keep),
+            "dtype": dtype,
+            "chunks": [self.chunks[row] for row in keep],
+            "source_versions": self.source_versions,
+            "build_params": self.build_params,
+        }
+        meta_path = os.path.join(path, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f, separators=(",", ":"))
+
+        # IVF centroids and bucket assignments, so loading skips k-means
+        ann_path = os.path.join(path, ANN_FILE)
+        if self.ann is not None:
+            with open(ann_path + ".tmp", "wb") as f:
+                np.savez(
+                    f,
+                    centroids=self.ann.centroids,
+                    assignments=self.ann.assignments()[keep],
+                    nprobe=self.ann.nprobe,
+                    trained_rows=self.ann.trained_rows,
+                )
+
+        os.replace(emb_path + ".tmp", emb_path)
+        os.replace(meta_path + ".tmp", meta_path)
+        if self.ann is not None:
+            os.replace(ann_path + ".tmp", ann_path)
+        elif os.path.exists(ann_path):
+            os.remove(ann_path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a saved index.
+
+        With mmap=True the embedding file is mapped read-only, so opening is
+        near-instant and several processes share the same pages. Adding
+        chunks to a mapped index copies it into memory first.
+        """
+        with open(os.path.join(path, META_FILE), "r") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format in {path}")
+
+        index = cls(dim=meta["dim"], storage=meta["dtype"])
+        shape = (meta["count"], meta["dim"])
+        emb_path = os.path.join(path, EMBEDDINGS_FILE)
+
+        if meta["count"] == 0:
+            matrix = np.empty(shape, dtype=meta["dtype"])
+        elif mmap:
+            matrix = np.memmap(emb_path, dtype=meta["dtype"], mode="r", shape=shape)
+        else:
+            matrix = np.fromfile(emb_path, dtype=meta["dtype"]).reshape(shape)
+
+        index._matrix = matrix
+        index._alive = np.ones(meta["count"], dtype=bool)
+        index._size = meta["count"]
+        index.chunks = meta["chunks"]
+        index.source_versions = meta.get("source_versions", {})
+        index.build_params = meta.get("build_params", {})
+        for chunk in index.chunks:
+            chunk.setdefault("hash", content_hash(chunk["text"]))
+        index._lexical = None
+
+        ann_path = os.path.join(path, ANN_FILE)
+        if os.path.exists(ann_path):
+            with np.load(ann_path) as saved:
+                if len(saved["assignments"]) == index._size:
+                    index.ann = IVFIndex(saved["centroids"], nprobe=int(saved["nprobe"]))
+                    index.ann.assign(saved["assignments"])
+                    index.ann.trained_rows = int(saved["trained_rows"])
+        index.total_tokens = sum(chunk.get("tokens", 0) for chunk in index.chunks)
+        return index